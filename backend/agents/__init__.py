@@ -1,70 +1,261 @@
 """Agents pour visualisation interactive des données"""
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+from __future__ import annotations
+
+import copy
+from collections import OrderedDict
+from itertools import cycle, islice
+import numpy as np
 import pandas as pd
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import plotly.graph_objects as go
+
+REQUIRED_COLS = ('Open', 'High', 'Low', 'Close')
+COLORS = ('#2E86AB', '#A23B72', '#F18F01', '#06A77D', '#D62828')
+
+# Paramètres de mise en page constants (non réalloués à chaque appel)
+_BASE_LAYOUT = dict(hovermode='x unified')
+_SINGLE_LAYOUT = {**_BASE_LAYOUT, 'height': 600, 'xaxis_rangeslider_visible': False}
+_MULTI_LAYOUT = {
+    **_BASE_LAYOUT,
+    'title': "Comparaison Multi-Tickers (Prix normalisé base 100)",
+    'xaxis_title': "Date",
+    'yaxis_title': "Prix (Base 100)",
+    'height': 500,
+}
+_OHLCV_SUBPLOTS = dict(
+    rows=2, cols=1,
+    shared_xaxes=True,
+    vertical_spacing=0.1,
+    row_heights=(0.7, 0.3),
+)
+
+# Hover partagé par toutes les traces (le ticker vient du nom ou du texte de la trace)
+_HOVER = "%{fullData.name}<br>Date: %{x|%Y-%m-%d}<br>Prix normalisé: %{y:.2f}<extra></extra>"
+_HOVER_GROUPED = "%{text}<br>Date: %{x|%Y-%m-%d}<br>Prix normalisé: %{y:.2f}<extra></extra>"
+
+# plotly est importé à la demande (voir _plotly)
+_go = None
+_make_subplots = None
+
+
+def _plotly() -> tuple:
+    """Importe plotly au premier tracé et le mémorise"""
+    global _go, _make_subplots
+    if _go is None:
+        import plotly.graph_objects as go
+        from plotly.subplots import make_subplots
+        _go, _make_subplots = go, make_subplots
+    return _go, _make_subplots
+
+
+_OHLCV_LAYOUT = None
+
+
+def _ohlcv_layout() -> dict:
+    """Copie de la mise en page Prix + Volume (make_subplots exécuté une seule fois)"""
+    global _OHLCV_LAYOUT
+    if _OHLCV_LAYOUT is None:
+        _, make_subplots = _plotly()
+        layout = make_subplots(subplot_titles=("Évolution du Prix", "Volume"), **_OHLCV_SUBPLOTS).layout.to_plotly_json()
+        layout.pop('template', None)
+        _OHLCV_LAYOUT = layout
+    return copy.deepcopy(_OHLCV_LAYOUT)
+
+
+def _extract(data_dict: Dict, tickers: List[str]):
+    """Itère (ticker, DataFrame) pour les tickers présents dans data_dict
+    
+    Accepte des valeurs {'dataframe': df, ...} ou directement un DataFrame.
+    """
+    for ticker in tickers:
+        if ticker not in data_dict:
+            continue
+        ticker_data = data_dict[ticker]
+        if isinstance(ticker_data, dict):
+            yield ticker, ticker_data.get('dataframe')
+        else:
+            yield ticker, ticker_data
+
+
+def _lttb_buckets(y: np.ndarray, n_out: int) -> tuple:
+    """Largest-Triangle-Three-Buckets sur une série
+    
+    Args:
+        y: Valeurs de la série (abscisse = position)
+        n_out: Nombre de points à conserver
+    
+    Returns:
+        (indices sélectionnés, bornes des buckets)
+    """
+    n = len(y)
+    x = np.arange(n, dtype=float)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    
+    selected = np.empty(n_out, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    
+    return selected, edges
+
+
+def _downsample_ohlc(df: pd.DataFrame, max_points: int) -> pd.DataFrame:
+    """Réduit un historique OHLC à ~max_points lignes
+    
+    LTTB sur Close, complété par les extrema High/Low de chaque bucket
+    pour préserver l'enveloppe des bougies.
+    """
+    n_out = max(3, max_points // 3)
+    if len(df) <= n_out:
+        return df
+    
+    selected, edges = _lttb_buckets(df['Close'].to_numpy(dtype=float), n_out)
+    high = df['High'].to_numpy(dtype=float)
+    low = df['Low'].to_numpy(dtype=float)
+    
+    extrema = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        extrema.append(start + int(np.argmax(high[start:end])))
+        extrema.append(start + int(np.argmin(low[start:end])))
+    
+    return df.iloc[np.unique(np.concatenate([selected, extrema]))]
+
 
 class InteractiveChartAgent:
     """Agent pour créer graphiques interactifs avec Plotly"""
     
-    def plot_single_ticker(self, df: pd.DataFrame, ticker: str) -> go.Figure:
+    # Au-delà, les séries sont fusionnées pour ne pas multiplier les traces WebGL
+    MAX_GL_TRACES = 6
+    # Sélections de tickers dont l'état incrémental est gardé (LRU)
+    CLOSES_CACHE_SIZE = 4
+    
+    def __init__(self):
+        # {frozenset(tickers): (longueurs, dernières valeurs, base, normalisé)}
+        self._closes_cache: OrderedDict = OrderedDict()
+    
+    def _normalized_closes(self, closes: Dict[str, pd.Series]) -> pd.DataFrame:
+        """Clôtures alignées et normalisées (base 100), avec cache incrémental
+        
+        Si les mêmes tickers sont redemandés et que chaque série ne fait que
+        s'allonger, seules les nouvelles lignes sont normalisées et ajoutées.
+        """
+        key = frozenset(closes)
+        lengths = {t: len(s) for t, s in closes.items()}
+        cached = self._closes_cache.get(key)
+        
+        if cached is not None:
+            old_lengths, old_last, base, normalized = cached
+            extends = all(
+                lengths[t] >= old_lengths[t]
+                and closes[t].index[old_lengths[t] - 1] == old_last[t][0]
+                and closes[t].iloc[old_lengths[t] - 1] == old_last[t][1]
+                for t in closes
+            )
+            if extends:
+                new_rows = pd.concat(
+                    {t: s.iloc[old_lengths[t]:] for t, s in closes.items()}, axis=1
+                ).dropna(how='all')
+                if new_rows.empty or new_rows.index.min() > normalized.index.max():
+                    if not new_rows.empty:
+                        normalized = pd.concat([normalized, new_rows.div(base).mul(100)])
+                    self._store_closes(key, closes, lengths, base, normalized)
+                    return normalized[list(closes)]
+        
+        aligned = pd.concat(closes, axis=1)
+        base = aligned.bfill().iloc[0]
+        normalized = aligned.div(base).mul(100)
+        self._store_closes(key, closes, lengths, base, normalized)
+        return normalized
+    
+    def _store_closes(self, key, closes, lengths, base, normalized):
+        """Mémorise l'état nécessaire à la prochaine mise à jour incrémentale"""
+        last = {t: (s.index[-1], s.iloc[-1]) for t, s in closes.items()}
+        self._closes_cache[key] = (lengths, last, base, normalized)
+        self._closes_cache.move_to_end(key)
+        while len(self._closes_cache) > self.CLOSES_CACHE_SIZE:
+            self._closes_cache.popitem(last=False)
+    
+    def plot_single_ticker(self, df: pd.DataFrame, ticker: str, max_points: int = 5000) -> go.Figure:
         """Graphique interactif pour un ticker
         
         Args:
             df: DataFrame avec colonnes Open, High, Low, Close, Volume
             ticker: Nom du ticker
+            max_points: Au-delà, l'historique est décimé (LTTB) avant tracé
         """
+        go, _ = _plotly()
+        
         if df is None or df.empty:
             return go.Figure().add_annotation(text=f"Pas de données pour {ticker}")
         
-        # Vérifier les colonnes requises
-        required_cols = ['Open', 'High', 'Low', 'Close']
-        if not all(col in df.columns for col in required_cols):
+        # Vérifier les colonnes requises (une seule passe sur l'Index)
+        columns = set(df.columns)
+        if not columns.issuperset(REQUIRED_COLS):
             return go.Figure().add_annotation(text=f"Colonnes manquantes pour {ticker}")
         
-        # Créer figure avec subplots (Prix + Volume)
-        fig = make_subplots(
-            rows=2, cols=1,
-            shared_xaxes=True,
-            vertical_spacing=0.1,
-            row_heights=[0.7, 0.3],
-            subplot_titles=(f"Évolution du Prix - {ticker}", "Volume")
-        )
+        # Décimation des longs historiques
+        if len(df) > max_points:
+            df = _downsample_ohlc(df, max_points)
+        
+        # Tableaux NumPy: évite la ré-inspection des Series par plotly
+        idx = df.index.to_numpy()
+        o, h, l, c = (df[col].to_numpy() for col in REQUIRED_COLS)
+        
+        # Volume absent ou nul (indices, FX): pas de second panneau
+        vol = df['Volume'].fillna(0).to_numpy() if 'Volume' in columns else None
+        has_volume = vol is not None and vol.any()
+        
+        if has_volume:
+            # Créer figure avec subplots (Prix + Volume)
+            layout = _ohlcv_layout()
+            layout['annotations'][0]['text'] = f"Évolution du Prix - {ticker}"
+            fig = go.Figure(layout=layout)
+        else:
+            fig = go.Figure()
         
         # Candlestick pour les prix
         fig.add_trace(
             go.Candlestick(
-                x=df.index,
-                open=df['Open'],
-                high=df['High'],
-                low=df['Low'],
-                close=df['Close'],
-                name='OHLC'
-            ),
-            row=1, col=1
+                x=idx,
+                open=o,
+                high=h,
+                low=l,
+                close=c,
+                name='OHLC',
+                xaxis='x',
+                yaxis='y'
+            )
         )
         
         # Volume
-        if 'Volume' in df.columns:
+        if has_volume:
             fig.add_trace(
                 go.Bar(
-                    x=df.index,
-                    y=df['Volume'],
+                    x=idx,
+                    y=vol,
                     name='Volume',
                     marker=dict(color='#F18F01'),
-                    showlegend=False
-                ),
-                row=2, col=1
+                    showlegend=False,
+                    xaxis='x2',
+                    yaxis='y2'
+                )
             )
         
         # Layout
-        fig.update_layout(
-            title=f"{ticker} - Données historiques",
-            height=600,
-            hovermode='x unified',
-            template='plotly_white',
-            xaxis_rangeslider_visible=False
-        )
+        fig.update_layout(title=f"{ticker} - Données historiques", template='plotly_white', **_SINGLE_LAYOUT)
         
         return fig
     
@@ -75,49 +266,68 @@ class InteractiveChartAgent:
             data_dict: Dict avec structure {ticker: {'dataframe': df, 'info': info}}
             tickers: Liste des tickers à afficher
         """
+        go, _ = _plotly()
+        
         fig = go.Figure()
         
-        colors = ['#2E86AB', '#A23B72', '#F18F01', '#06A77D', '#D62828']
+        # Validation séparée de la construction des traces
+        valid = [
+            (ticker, df) for ticker, df in _extract(data_dict, tickers)
+            if df is not None and not df.empty and 'Close' in df.columns
+        ]
+        closes = {ticker: df['Close'] for ticker, df in valid}
         
-        for i, ticker in enumerate(tickers):
-            if ticker not in data_dict:
-                continue
+        # Normaliser prix (base 100) en une seule opération vectorisée
+        if closes:
+            normalized = self._normalized_closes(closes)
             
-            # Handle dict with 'dataframe' key
-            ticker_data = data_dict[ticker]
-            if isinstance(ticker_data, dict):
-                df = ticker_data.get('dataframe')
+            if len(normalized.columns) <= self.MAX_GL_TRACES:
+                # WebGL: une trace par ticker
+                trace_colors = islice(cycle(COLORS), len(normalized.columns))
+                for (ticker, col), color in zip(normalized.items(), trace_colors):
+                    col = col.dropna()
+                    fig.add_trace(
+                        go.Scattergl(
+                            x=col.index.to_numpy(),
+                            y=col.to_numpy(),
+                            name=ticker,
+                            line=dict(color=color, width=2),
+                            hovertemplate=_HOVER
+                        )
+                    )
             else:
-                df = ticker_data
-            
-            if df is None or df.empty:
-                continue
-            
-            if 'Close' not in df.columns:
-                continue
-            
-            # Normaliser prix (base 100)
-            first_price = df['Close'].iloc[0]
-            normalized = (df['Close'] / first_price) * 100
-            
-            fig.add_trace(
-                go.Scatter(
-                    x=df.index,
-                    y=normalized,
-                    name=ticker,
-                    line=dict(color=colors[i % len(colors)], width=2),
-                    hovertemplate=f"{ticker}<br>Date: %{{x|%Y-%m-%d}}<br>Prix normalisé: %{{y:.2f}}"
-                )
-            )
+                # Trop de tickers: une trace WebGL par couleur, séries séparées par NaN
+                series = [(ticker, col.dropna()) for ticker, col in normalized.items()]
+                for bucket, color in enumerate(COLORS):
+                    group = series[bucket::len(COLORS)]
+                    if not group:
+                        break
+                    
+                    size = sum(len(col) for _, col in group) + len(group)
+                    x_all = np.empty(size, dtype=object)
+                    y_all = np.full(size, np.nan)
+                    text_all = np.empty(size, dtype=object)
+                    
+                    pos = 0
+                    for ticker, col in group:
+                        end = pos + len(col)
+                        x_all[pos:end] = col.index.to_numpy(dtype=object)
+                        y_all[pos:end] = col.to_numpy()
+                        text_all[pos:end + 1] = ticker
+                        pos = end + 1
+                    
+                    fig.add_trace(
+                        go.Scattergl(
+                            x=x_all,
+                            y=y_all,
+                            text=text_all,
+                            name=", ".join(ticker for ticker, _ in group),
+                            line=dict(color=color, width=2),
+                            hovertemplate=_HOVER_GROUPED
+                        )
+                    )
         
-        fig.update_layout(
-            title="Comparaison Multi-Tickers (Prix normalisé base 100)",
-            xaxis_title="Date",
-            yaxis_title="Prix (Base 100)",
-            height=500,
-            hovermode='x unified',
-            template='plotly_white'
-        )
+        fig.update_layout(template='plotly_white', **_MULTI_LAYOUT)
         
         return fig
     
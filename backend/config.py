@@ -1,10 +1,25 @@
 """Configuration centrale pour l'application"""
+import logging
 import os
-from dataclasses import dataclass
-from typing import Optional
-import google.generativeai as genai
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Optional
 
-@dataclass
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=32)
+def _gen_config(temperature: float, max_output_tokens: int):
+    """GenerationConfig partagée par couple (temperature, max_output_tokens)"""
+    import google.generativeai as genai
+    
+    return genai.types.GenerationConfig(
+        temperature=temperature,
+        max_output_tokens=max_output_tokens,
+    )
+
+
+@dataclass(slots=True)
 class GeminiConfig:
     """Configuration Gemini API"""
     api_key: str
@@ -12,17 +27,21 @@ class GeminiConfig:
     temperature: float = 0.7
     max_output_tokens: int = 2048
     timeout: int = 30
+    _client: Optional[Any] = field(default=None, init=False, repr=False, compare=False)
     
     def initialize_client(self):
-        """Initialise le client Gemini"""
+        """Initialise le client Gemini (construit une seule fois par instance)"""
+        if self._client is not None:
+            return self._client
+        
+        import google.generativeai as genai
+        
         genai.configure(api_key=self.api_key)
-        return genai.GenerativeModel(
+        self._client = genai.GenerativeModel(
             self.model,
-            generation_config=genai.types.GenerationConfig(
-                temperature=self.temperature,
-                max_output_tokens=self.max_output_tokens,
-            )
+            generation_config=_gen_config(self.temperature, self.max_output_tokens)
         )
+        return self._client
     
     @classmethod
     def from_env(cls, api_key: Optional[str] = None) -> 'GeminiConfig':
@@ -32,14 +51,28 @@ class GeminiConfig:
             raise ValueError("GEMINI_API_KEY not provided")
         return cls(api_key=key)
     
-    def validate(self) -> bool:
-        """Valide la clé API"""
+    def validate(self, deep: bool = False) -> bool:
+        """Valide la clé API via un appel de métadonnées authentifié
+        
+        Args:
+            deep: Si True, envoie en plus une vraie requête de génération
+                (facturée, plus lente)
+        """
+        import google.generativeai as genai
+        from google.api_core import exceptions as google_exceptions
+        
         try:
             genai.configure(api_key=self.api_key)
-            # Test avec une requête simple
-            test_model = genai.GenerativeModel(self.model)
-            test_model.generate_content("Test")
+            # Appel authentifié léger (liste des modèles)
+            next(iter(genai.list_models()), None)
+            if deep:
+                # Test avec une requête simple
+                test_model = genai.GenerativeModel(self.model)
+                test_model.generate_content("Test")
             return True
+        except (google_exceptions.Unauthenticated, google_exceptions.PermissionDenied) as e:
+            logger.warning("Clé API refusée: %s", e)
+            return False
         except Exception as e:
-            print(f"Validation error: {e}")
+            logger.warning("Validation error: %s", e)
             return False
@@ -1,16 +1,18 @@
 """RAG pour documents PDF"""
 from dataclasses import dataclass
-from typing import List, Dict, Optional
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 import numpy as np
-from concurrent.futures import ThreadPoolExecutor
+import shutil
 import tempfile
 
 from backend.services.pdf_processor import PDFProcessor
 from backend.services.gemini_service import GeminiService
-from backend.utils import EmbeddingService
-from backend.utils.reranker import RerankerService
-from backend.utils import FAISSService
-from backend.prompts import PDF_QUERY_PROMPT
+from backend.utils import get_embedding_service
+from backend.utils.reranker import get_reranker_service
+from backend.utils import FAISSService, IndexCache, SemanticCache
+from backend.prompts import PDF_QUERY_TEMPLATE
+
+__all__ = ['PDFRagPipeline', 'PDFChunk']
 
 @dataclass
 class PDFChunk:
@@ -18,105 +20,159 @@ class PDFChunk:
     text: str
     page_num: int
     chunk_id: int
-    embedding: Optional[np.ndarray] = None
 
 class PDFRagPipeline:
     """Pipeline RAG complète pour PDF"""
     
+    COPY_CHUNK_SIZE = 1024 * 1024
+    
     def __init__(self, gemini_service: GeminiService):
         self.gemini_service = gemini_service
-        self.embedding_service = EmbeddingService()
-        self.reranker_service = RerankerService()
+        self.embedding_service = get_embedding_service()
+        self.reranker_service = get_reranker_service()
         
         self.chunks: List[PDFChunk] = []
         self.embeddings: Optional[np.ndarray] = None
         self.faiss_index = None
+        # Métadonnées colonnaires des chunks (indexées par les ids FAISS)
+        self._chunk_texts = np.empty(0, dtype=object)
+        self._chunk_pages = np.empty(0, dtype=np.int32)
+        self._chunk_ids = np.empty(0, dtype=np.int32)
+        # Compteurs fixés une fois l'index prêt (affichage des statistiques)
+        self.num_pages = 0
+        self.num_chunks = 0
         self.pdf_path: Optional[str] = None
+        # Réponses par question (reformulations comprises) pour ce document
+        self.answer_cache = SemanticCache()
     
-    def process_pdf(self, pdf_file) -> bool:
-        """Traite un fichier PDF uploadé"""
+    def process_pdf(self, pdf_file, progress_cb: Optional[Callable[[float, str], None]] = None) -> bool:
+        """Traite un fichier PDF uploadé
+        
+        progress_cb(fraction, message) est appelé au début de chaque étape.
+        """
+        report = progress_cb or (lambda fraction, message: None)
         try:
-            # Sauvegarder temporairement
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
-                tmp.write(pdf_file.getbuffer())
+            # Même PDF déjà indexé: pas de ré-extraction ni ré-embedding,
+            # ni copie sur disque (empreinte calculée sur l'upload en mémoire)
+            pdf_file.seek(0)
+            cache_key = IndexCache.key_for_model(
+                IndexCache.key_for_fileobj(pdf_file), self.embedding_service.model_tag()
+            )
+            cached = IndexCache.load(cache_key)
+            if cached is not None:
+                report(0.9, "Chargement de l'index existant...")
+                self.faiss_index, self.chunks = cached
+                self._index_chunk_metadata()
+                return True
+            
+            report(0.1, "Extraction et traitement du texte...")
+            
+            # Sauvegarder temporairement (les workers d'extraction lisent un chemin)
+            # Copie par blocs de 1 Mo: mémoire bornée quelle que soit la taille
+            pdf_file.seek(0)
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf', buffering=self.COPY_CHUNK_SIZE) as tmp:
+                shutil.copyfileobj(pdf_file, tmp, length=self.COPY_CHUNK_SIZE)
                 self.pdf_path = tmp.name
             
-            # Extraction parallèle
-            with ThreadPoolExecutor(max_workers=3) as executor:
-                future_extract = executor.submit(PDFProcessor.extract_text_from_pdf, self.pdf_path)
-                future_model = executor.submit(self.embedding_service.load_model)
-                
-                pages_text = future_extract.result()
-                _ = future_model.result()
+            # Le modèle d'embedding est déjà chargé (model_tag de la clé de cache)
+            pages_text = PDFProcessor.extract_text_from_pdf(self.pdf_path)
             
             # Créer chunks
-            chunk_id = 0
-            for page_num, text in pages_text.items():
-                cleaned = PDFProcessor.clean_text(text)
-                chunks = PDFProcessor.chunk_text(cleaned)
-                
-                for chunk_text in chunks:
-                    self.chunks.append(PDFChunk(
-                        text=chunk_text,
-                        page_num=page_num,
-                        chunk_id=chunk_id
-                    ))
-                    chunk_id += 1
+            report(0.45, "Découpage du texte en chunks...")
+            self.chunks = [
+                PDFChunk(text=chunk_text, page_num=page_num, chunk_id=chunk_id)
+                for chunk_id, (page_num, chunk_text) in enumerate(self._iter_clean_chunks(pages_text))
+            ]
             
             # Embeddings et index FAISS
+            report(0.55, "Création des embeddings...")
             texts = [chunk.text for chunk in self.chunks]
-            self.embeddings = self.embedding_service.get_embeddings(texts)
-            
-            for i, chunk in enumerate(self.chunks):
-                chunk.embedding = self.embeddings[i]
+            # Chunks déjà encodés (autres PDF) relus depuis le cache disque
+            self.embeddings = self.embedding_service.get_embeddings_cached(texts)
             
+            report(0.9, "Indexation FAISS...")
             self.faiss_index = FAISSService.build_index(self.embeddings)
+            # FAISS possède désormais sa copie des vecteurs
+            self.embeddings = None
+            IndexCache.save(cache_key, self.faiss_index, self.chunks)
+            self._index_chunk_metadata()
             
             return True
         except Exception as e:
             print(f"Erreur processing PDF: {e}")
             return False
     
+    @staticmethod
+    def _iter_clean_chunks(pages_text: Dict[int, str]) -> Iterator[Tuple[int, str]]:
+        """Génère (page, texte) pour chaque chunk nettoyé, dans l'ordre des pages"""
+        for page_num, text in pages_text.items():
+            for chunk_text in PDFProcessor.chunk_text(PDFProcessor.clean_text(text)):
+                yield page_num, chunk_text
+    
+    def _index_chunk_metadata(self):
+        """Matérialise les métadonnées des chunks en tableaux numpy"""
+        self._chunk_texts = np.array([c.text for c in self.chunks], dtype=object)
+        self._chunk_pages = np.array([c.page_num for c in self.chunks], dtype=np.int32)
+        self._chunk_ids = np.array([c.chunk_id for c in self.chunks], dtype=np.int32)
+        self.num_pages = len(np.unique(self._chunk_pages))
+        self.num_chunks = len(self.chunks)
+    
     def retrieve(self, query: str, k: int = 5) -> List[Dict]:
         """Récupère chunks pertinents"""
         if not self.faiss_index:
             return []
         
-        query_embedding = self.embedding_service.get_embedding(query)
-        distances, indices = FAISSService.search(self.faiss_index, query_embedding, k)
+        return self.retrieve_batch([query], k)[0]
+    
+    def retrieve_batch(self, queries: List[str], k: int = 5) -> List[List[Dict]]:
+        """Récupère chunks pertinents pour plusieurs requêtes (une passe d'encodage)"""
+        if not self.faiss_index or not queries:
+            return [[] for _ in queries]
+        
+        return self._search_embeddings(self.embedding_service.get_embeddings_batch(queries), k)
+    
+    def _search_embeddings(self, query_embeddings: np.ndarray, k: int) -> List[List[Dict]]:
+        """Chunks des k plus proches voisins de chaque embedding de requête"""
+        distances, indices = FAISSService.search_batch(self.faiss_index, query_embeddings, k)
         
-        results = []
-        for idx in indices:
-            chunk = self.chunks[idx]
-            results.append({
-                'text': chunk.text,
-                'page': chunk.page_num,
-                'chunk_id': chunk.chunk_id
-            })
+        batch_results = []
+        for row in indices:
+            valid = row[row >= 0]  # FAISS renvoie -1 quand moins de k résultats
+            batch_results.append([
+                {'text': text, 'page': int(page), 'chunk_id': int(chunk_id)}
+                for text, page, chunk_id in zip(
+                    self._chunk_texts[valid], self._chunk_pages[valid], self._chunk_ids[valid]
+                )
+            ])
         
-        return results
+        return batch_results
     
     def rerank(self, query: str, chunks: List[Dict], top_k: int = 3) -> List[Dict]:
         """Reranking des chunks"""
         texts = [chunk['text'] for chunk in chunks]
-        ranked = self.reranker_service.rerank(query, texts, top_k)
+        order, scores = self.reranker_service.rerank_indices(query, texts, top_k)
         
-        # Retourner chunks réankés avec métadatas
-        return [
-            {
-                **chunks[item['index']],
-                'rerank_score': item['score']
-            }
-            for item in ranked
-        ]
+        # Dicts issus de retrieve(): score ajouté en place, sans copie
+        ranked = []
+        for i, score in zip(order, scores):
+            chunk = chunks[i]
+            chunk['rerank_score'] = score
+            ranked.append(chunk)
+        return ranked
     
     def query(self, question: str, k: int = 5, rerank_top_k: int = 10, use_streaming: bool = False) -> Dict:
         """Requête complète RAG
         
         NOTE: Streaming est DÉSACTIVÉ pour éviter les problèmes avec Streamlit
         """
+        # Question déjà posée ou reformulée: réponse mémorisée, sans LLM
+        query_embedding = self.embedding_service.get_embeddings_batch([question])
+        cached = self.answer_cache.get(query_embedding[0], question=question)
+        if cached is not None:
+            return {**cached, 'question': question}
+        
         # Retrieve
-        chunks = self.retrieve(question, k=k)
+        chunks = self._search_embeddings(query_embedding, k)[0] if self.faiss_index else []
         
         if not chunks:
             return {
@@ -130,10 +186,10 @@ class PDFRagPipeline:
         ranked_chunks = self.rerank(question, chunks, top_k=rerank_top_k)
         
         # Contexte
-        context = "\n\n".join([
+        context = "\n\n".join(
             f"[{i+1}] (Page {chunk['page']})\n{chunk['text']}"
             for i, chunk in enumerate(ranked_chunks)
-        ])
+        )
         
         if not context.strip():
             return {
@@ -144,24 +200,23 @@ class PDFRagPipeline:
             }
         
         # Prompt - Utiliser le prompt centralisé
-        prompt = PDF_QUERY_PROMPT.format(context=context, question=question)
+        prompt = PDF_QUERY_TEMPLATE.substitute(context=context, question=question)
         
         # Générer réponse - JAMAIS de streaming
         try:
             response = self.gemini_service.generate(prompt)
+            # Quota / erreur API rendus en texte: jamais mémorisés
+            failed = GeminiService.is_error(response)
         except Exception as e:
             response = f"❌ Erreur: {str(e)}"
+            failed = True
         
-        return {
-            'question': question,
-            'response': response,
-            'sources': ranked_chunks,
-            'context': context
-        }
-        
-        return {
+        result = {
             'question': question,
             'response': response,
             'sources': ranked_chunks,
             'context': context
         }
+        if not failed:
+            self.answer_cache.put(query_embedding[0], result, question=question)
+        return result
@@ -1,16 +1,21 @@
 """RAG pour données Yahoo Finance"""
 from dataclasses import dataclass
-from typing import List, Dict, Optional
+from typing import List, Dict, Generator, Optional, Tuple
 import numpy as np
+import logging
 import pandas as pd
 from datetime import datetime, timedelta
 
 from backend.services.gemini_service import GeminiService
 from backend.services.yfinance_service import YFinanceService
-from backend.utils import EmbeddingService
-from backend.utils.reranker import RerankerService
-from backend.utils import FAISSService
-from backend.prompts import YFINANCE_QUERY_PROMPT
+from backend.utils import get_embedding_service
+from backend.utils.reranker import get_reranker_service
+from backend.utils import FAISSService, IndexCache, SemanticCache
+from backend.prompts import YFINANCE_QUERY_TEMPLATE
+
+__all__ = ['YFinanceRagAssistant', 'MarketChunk']
+
+logger = logging.getLogger(__name__)
 
 @dataclass
 class MarketChunk:
@@ -19,21 +24,28 @@ class MarketChunk:
     ticker: str
     chunk_id: int
     chunk_type: str  # 'daily' ou 'monthly'
-    embedding: Optional[np.ndarray] = None
 
 class YFinanceRagAssistant:
     """RAG pour données Yahoo Finance"""
     
     def __init__(self, gemini_service: GeminiService, tickers: List[str] = None):
         self.gemini_service = gemini_service
-        self.embedding_service = EmbeddingService()
-        self.reranker_service = RerankerService()
+        self.embedding_service = get_embedding_service()
+        self.reranker_service = get_reranker_service()
         
         self.tickers = tickers or ['AAPL', 'MSFT', 'GOOGL', 'AMZN', 'TSLA']
         self.data: Dict[str, pd.DataFrame] = {}
         self.chunks: List[MarketChunk] = []
         self.embeddings: Optional[np.ndarray] = None
         self.faiss_index = None
+        # Métadonnées colonnaires des chunks (indexées par les ids FAISS)
+        self._chunk_texts = np.empty(0, dtype=object)
+        self._chunk_tickers = np.empty(0, dtype=object)
+        self._chunk_types = np.empty(0, dtype=object)
+        self._chunk_ids = np.empty(0, dtype=np.int32)
+        # Réponses par question (reformulations comprises); un rechargement
+        # des données crée un nouvel assistant, donc un cache vide
+        self.answer_cache = SemanticCache()
     
     def fetch_and_process_data(self, period_months: int = 20) -> bool:
         """Récupère et traite données YFinance"""
@@ -64,132 +76,207 @@ class YFinanceRagAssistant:
                     agg_dict['Volume'] = 'sum'
                 
                 if not agg_dict:
-                    print(f"Colonnes disponibles pour {ticker}: {df.columns.tolist()}")
+                    logger.warning("Colonnes disponibles pour %s: %s", ticker, df.columns.tolist())
                     continue
                 
-                weekly_chunks = df.resample('W').agg(agg_dict)
+                weekly_chunks, monthly = self._aggregate_periods(df, agg_dict, ('W', 'M'))
                 
-                for date, row in weekly_chunks.iterrows():
-                    text = f"{ticker} semaine {date.strftime('%Y-%m-%d')}: "
-                    text += f"Open ${row['Open']:.2f}, High ${row['High']:.2f}, "
-                    text += f"Low ${row['Low']:.2f}, Close ${row['Close']:.2f}, "
-                    text += f"Volume {int(row['Volume']):,}"
-                    
-                    self.chunks.append(MarketChunk(
-                        text=text,
-                        ticker=ticker,
-                        chunk_id=chunk_id,
-                        chunk_type='weekly'
-                    ))
-                    chunk_id += 1
+                # Formatage colonne par colonne (pas d'iterrows / Series par ligne)
+                texts = [
+                    f"{ticker} semaine {date}: "
+                    f"Open ${o:.2f}, High ${h:.2f}, "
+                    f"Low ${l:.2f}, Close ${c:.2f}, "
+                    f"Volume {v:,}"
+                    for date, o, h, l, c, v in zip(
+                        weekly_chunks.index.strftime('%Y-%m-%d'),
+                        weekly_chunks['Open'].to_numpy(),
+                        weekly_chunks['High'].to_numpy(),
+                        weekly_chunks['Low'].to_numpy(),
+                        weekly_chunks['Close'].to_numpy(),
+                        self._volumes(weekly_chunks),
+                    )
+                ]
+                self.chunks.extend(
+                    MarketChunk(text=text, ticker=ticker, chunk_id=chunk_id + i, chunk_type='weekly')
+                    for i, text in enumerate(texts)
+                )
+                chunk_id += len(texts)
                 
                 # Chunks mensuels (résumé)
-                monthly = df.resample('M').agg(agg_dict)
-                
-                for date, row in monthly.iterrows():
-                    variation = ((row['Close'] - row['Open']) / row['Open'] * 100)
-                    text = f"{ticker} {date.strftime('%B %Y')}: "
-                    text += f"${row['Open']:.2f}→${row['Close']:.2f} "
-                    text += f"({variation:+.2f}%), Volume {int(row['Volume']):,}"
-                    
-                    self.chunks.append(MarketChunk(
-                        text=text,
-                        ticker=ticker,
-                        chunk_id=chunk_id,
-                        chunk_type='monthly'
-                    ))
-                    chunk_id += 1
+                opens = monthly['Open'].to_numpy()
+                closes = monthly['Close'].to_numpy()
+                variations = (closes - opens) / opens * 100
+                texts = [
+                    f"{ticker} {date}: "
+                    f"${o:.2f}→${c:.2f} "
+                    f"({var:+.2f}%), Volume {v:,}"
+                    for date, o, c, var, v in zip(
+                        monthly.index.strftime('%B %Y'),
+                        opens,
+                        closes,
+                        variations,
+                        self._volumes(monthly),
+                    )
+                ]
+                self.chunks.extend(
+                    MarketChunk(text=text, ticker=ticker, chunk_id=chunk_id + i, chunk_type='monthly')
+                    for i, text in enumerate(texts)
+                )
+                chunk_id += len(texts)
             
             # Embeddings
             texts = [chunk.text for chunk in self.chunks]
-            self.embeddings = self.embedding_service.get_embeddings(texts)
             
-            for i, chunk in enumerate(self.chunks):
-                chunk.embedding = self.embeddings[i]
+            # Données de marché inchangées depuis le dernier index: réouverture
+            cache_key = IndexCache.key_for_model(
+                IndexCache.key_for_texts(texts), self.embedding_service.model_tag()
+            )
+            cached = IndexCache.load(cache_key)
+            if cached is not None:
+                self.faiss_index, _ = cached
+                self._index_chunk_metadata()
+                return True
+            
+            self.embeddings = self.embedding_service.get_embeddings(texts)
             
             self.faiss_index = FAISSService.build_index(self.embeddings)
+            # FAISS possède désormais sa copie des vecteurs
+            self.embeddings = None
+            IndexCache.save(cache_key, self.faiss_index, self.chunks)
+            self._index_chunk_metadata()
             
             return True
         except Exception as e:
-            print(f"Erreur fetch/process data: {e}")
+            logger.exception("Erreur fetch/process data: %s", e)
             return False
     
+    @staticmethod
+    def _aggregate_periods(df: pd.DataFrame, agg_dict: Dict[str, str], freqs) -> List[pd.DataFrame]:
+        """Agrège OHLCV par période (équivalent resample, sans périodes vides)
+        
+        Les colonnes et l'index naïf sont matérialisés une seule fois puis
+        partagés entre fréquences; chaque fréquence est un groupby cythonisé.
+        Les lignes sont étiquetées par le dernier jour de la période.
+        """
+        index = df.index.tz_localize(None) if df.index.tz is not None else df.index
+        values = df[list(agg_dict)]
+        
+        results = []
+        for freq in freqs:
+            periods = index.to_period(freq)
+            agg = values.groupby(periods, sort=True).agg(agg_dict)
+            agg.index = agg.index.end_time.normalize()
+            results.append(agg)
+        return results
+    
+    @staticmethod
+    def _volumes(agg: pd.DataFrame) -> List[int]:
+        """Volumes en int Python (une conversion C plutôt qu'un int() par ligne)"""
+        return agg['Volume'].to_numpy(dtype=np.int64).tolist()
+    
+    def _index_chunk_metadata(self):
+        """Matérialise les métadonnées des chunks en tableaux numpy"""
+        self._chunk_texts = np.array([c.text for c in self.chunks], dtype=object)
+        self._chunk_tickers = np.array([c.ticker for c in self.chunks], dtype=object)
+        self._chunk_types = np.array([c.chunk_type for c in self.chunks], dtype=object)
+        self._chunk_ids = np.array([c.chunk_id for c in self.chunks], dtype=np.int32)
+    
     def retrieve(self, query: str, k: int = 5) -> List[Dict]:
         """Récupère chunks pertinents"""
         if not self.faiss_index:
             return []
         
-        query_embedding = self.embedding_service.get_embedding(query)
-        distances, indices = FAISSService.search(self.faiss_index, query_embedding, k)
+        return self.retrieve_batch([query], k)[0]
+    
+    def retrieve_batch(self, queries: List[str], k: int = 5) -> List[List[Dict]]:
+        """Récupère chunks pertinents pour plusieurs requêtes (une passe d'encodage)"""
+        if not self.faiss_index or not queries:
+            return [[] for _ in queries]
         
-        results = []
-        for idx in indices:
-            chunk = self.chunks[idx]
-            results.append({
-                'text': chunk.text,
-                'ticker': chunk.ticker,
-                'chunk_type': chunk.chunk_type,
-                'chunk_id': chunk.chunk_id
-            })
+        return self._search_embeddings(self.embedding_service.get_embeddings_batch(queries), k)
+    
+    def _search_embeddings(self, query_embeddings: np.ndarray, k: int) -> List[List[Dict]]:
+        """Chunks des k plus proches voisins de chaque embedding de requête"""
+        distances, indices = FAISSService.search_batch(self.faiss_index, query_embeddings, k)
         
-        return results
+        batch_results = []
+        for row in indices:
+            valid = row[row >= 0]  # FAISS renvoie -1 quand moins de k résultats
+            batch_results.append([
+                {'text': text, 'ticker': ticker, 'chunk_type': chunk_type, 'chunk_id': int(chunk_id)}
+                for text, ticker, chunk_type, chunk_id in zip(
+                    self._chunk_texts[valid], self._chunk_tickers[valid],
+                    self._chunk_types[valid], self._chunk_ids[valid]
+                )
+            ])
+        
+        return batch_results
     
     def rerank(self, query: str, chunks: List[Dict], top_k: int = 3) -> List[Dict]:
         """Reranking"""
         texts = [chunk['text'] for chunk in chunks]
-        ranked = self.reranker_service.rerank(query, texts, top_k)
-        
-        return [
-            {
-                **chunks[item['index']],
-                'rerank_score': item['score']
-            }
-            for item in ranked
-        ]
+        order, scores = self.reranker_service.rerank_indices(query, texts, top_k)
+        
+        # Dicts issus de retrieve(): score ajouté en place, sans copie
+        ranked = []
+        for i, score in zip(order, scores):
+            chunk = chunks[i]
+            chunk['rerank_score'] = score
+            ranked.append(chunk)
+        return ranked
     
-    def query(self, question: str, tickers: Optional[List[str]] = None, k: int = 5, rerank_top_k: int = 10, use_streaming: bool = False) -> Dict:
-        """Requête sur données YFinance
+    def _prepare_query(self, question: str, tickers: Optional[List[str]], k: int, rerank_top_k: int) -> Tuple[Dict, Optional[str], Optional[np.ndarray]]:
+        """Retrieval commun à query() et query_stream()
         
-        NOTE: Streaming est DÉSACTIVÉ pour éviter les problèmes avec Streamlit
+        Retourne (résultat, prompt, embedding de la question). prompt est None quand
+        le résultat est déjà final (erreur, pas de contexte, cache sémantique).
         """
-        # DEBUG
-        print(f"\n🔍 [QUERY] START - Question: {question}")
-        print(f"🔍 [QUERY] FAISS index exists: {self.faiss_index is not None}")
-        print(f"🔍 [QUERY] Total chunks available: {len(self.chunks)}")
+        logger.debug(
+            "[QUERY] START question=%r index=%s chunks=%d",
+            question, self.faiss_index is not None, len(self.chunks)
+        )
         
         # Vérifier que l'index existe
         if not self.faiss_index:
-            print(f"❌ [QUERY] No FAISS index!")
+            logger.warning("[QUERY] No FAISS index")
             return {
                 'question': question,
                 'response': '❌ Erreur: Pas de données indexées. Chargez les données d\'abord.',
                 'sources': [],
                 'context': '',
                 'tickers': tickers or self.tickers
-            }
+            }, None, None
+        
+        # Question déjà posée ou reformulée (mêmes tickers): réponse mémorisée, sans LLM
+        cache_scope = tuple(tickers) if tickers else None
+        query_embedding = self.embedding_service.get_embeddings_batch([question])
+        cached = self.answer_cache.get(query_embedding[0], cache_scope, question)
+        if cached is not None:
+            logger.debug("[QUERY] Semantic cache hit")
+            return {**cached, 'question': question}, None, None
         
         # Filtrer chunks par tickers si spécifié
-        chunks = self.retrieve(question, k=k)
-        print(f"🔍 [QUERY] Retrieved {len(chunks)} chunks")
+        chunks = self._search_embeddings(query_embedding, k)[0]
+        logger.debug("[QUERY] Retrieved %d chunks", len(chunks))
         
         if tickers:
             chunks = [c for c in chunks if c['ticker'] in tickers]
-            print(f"🔍 [QUERY] After filtering by tickers: {len(chunks)}")
+            logger.debug("[QUERY] After filtering by tickers: %d", len(chunks))
         
         # Si pas de chunks, retourner message d'erreur
         if not chunks:
-            print(f"❌ [QUERY] No chunks found!")
+            logger.debug("[QUERY] No chunks found")
             return {
                 'question': question,
                 'response': '⚠️ Aucune donnée pertinente trouvée pour votre question.',
                 'sources': [],
                 'context': '',
                 'tickers': tickers or self.tickers
-            }
+            }, None, None
         
         # Rerank
         ranked_chunks = self.rerank(question, chunks, top_k=rerank_top_k)
-        print(f"🔍 [QUERY] Ranked {len(ranked_chunks)} chunks")
+        logger.debug("[QUERY] Ranked %d chunks", len(ranked_chunks))
         
         # Pour YFinance: utiliser UNIQUEMENT le chunk le plus récent (le premier)
         if ranked_chunks:
@@ -200,37 +287,72 @@ class YFinanceRagAssistant:
             context = ""
             sources = []
         
-        print(f"🔍 [QUERY] Using only most recent chunk for context")
-        print(f"🔍 [QUERY] Context length: {len(context)} chars")
+        logger.debug("[QUERY] Context from top-1 chunk: %d chars", len(context))
         
         # Si contexte vide, retourner erreur
         if not context.strip():
-            print(f"❌ [QUERY] Empty context!")
+            logger.debug("[QUERY] Empty context")
             return {
                 'question': question,
                 'response': '⚠️ Contexte vide - impossible de générer réponse.',
                 'sources': sources,
                 'context': context,
                 'tickers': tickers or self.tickers
-            }
+            }, None, None
         
         # Prompt - Utiliser le prompt centralisé
-        prompt = YFINANCE_QUERY_PROMPT.format(context=context, question=question)
-        print(f"🔍 [QUERY] Prompt length: {len(prompt)} chars")
-        print(f"🔍 [QUERY] Calling LLM.generate() (NO STREAMING)...", flush=True)
-        
-        try:
-            # JAMAIS de streaming en Streamlit - utiliser generate() uniquement
-            response = self.gemini_service.generate(prompt)
-            print(f"🔍 [QUERY] LLM response received: {len(response)} chars", flush=True)
-        except Exception as e:
-            print(f"❌ [QUERY] LLM Error: {e}", flush=True)
-            response = f"❌ Erreur LLM: {str(e)}"
+        prompt = YFINANCE_QUERY_TEMPLATE.substitute(context=context, question=question)
+        logger.debug("[QUERY] Prompt length: %d chars", len(prompt))
         
         return {
             'question': question,
-            'response': response,
+            'response': '',
             'sources': ranked_chunks,
             'context': context,
             'tickers': tickers or self.tickers
-        }
+        }, prompt, query_embedding
+    
+    def query(self, question: str, tickers: Optional[List[str]] = None, k: int = 5, rerank_top_k: int = 10, use_streaming: bool = False) -> Dict:
+        """Requête sur données YFinance
+        
+        NOTE: réponse complète en un bloc; query_stream() pour l'affichage progressif
+        """
+        result, prompt, query_embedding = self._prepare_query(question, tickers, k, rerank_top_k)
+        if prompt is None:
+            return result
+        
+        try:
+            response = self.gemini_service.generate(prompt)
+            logger.debug("[QUERY] LLM response received: %d chars", len(response))
+            # Quota / erreur API rendus en texte: jamais mémorisés
+            failed = GeminiService.is_error(response)
+        except Exception as e:
+            logger.warning("[QUERY] LLM error: %s", e)
+            response = f"❌ Erreur LLM: {str(e)}"
+            failed = True
+        
+        result['response'] = response
+        if not failed:
+            self.answer_cache.put(query_embedding[0], result, tuple(tickers) if tickers else None, question)
+        return result
+    
+    def query_stream(self, question: str, tickers: Optional[List[str]] = None, k: int = 5, rerank_top_k: int = 10) -> Generator[str, None, None]:
+        """Comme query(), mais produit la réponse morceau par morceau (st.write_stream)"""
+        result, prompt, query_embedding = self._prepare_query(question, tickers, k, rerank_top_k)
+        if prompt is None:
+            yield result['response']
+            return
+        
+        parts = []
+        failed = False
+        for text in self.gemini_service.stream(prompt, max_tokens=2048):
+            # stream() rend ses erreurs en texte, éventuellement après une réponse partielle
+            failed = failed or GeminiService.is_error(text)
+            parts.append(text)
+            yield text
+        
+        response = ''.join(parts)
+        logger.debug("[QUERY] LLM stream finished: %d chars", len(response))
+        if response and not failed:
+            result['response'] = response
+            self.answer_cache.put(query_embedding[0], result, tuple(tickers) if tickers else None, question)
@@ -1,30 +1,69 @@
 """Service Gemini pour appels LLM avec streaming"""
 import google.generativeai as genai
-from typing import Generator
-import asyncio
+from collections import OrderedDict
+from typing import AsyncGenerator, Generator, Optional
+import hashlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
 
 
 class GeminiService:
     """Service pour appels à l'API Gemini avec streaming"""
     
+    # Cache LRU+TTL des réponses de generate() (reruns Streamlit, questions répétées)
+    CACHE_SIZE = 256
+    CACHE_TTL = 300  # secondes
+    # Au-delà, l'échantillonnage est voulu variable: pas de cache
+    CACHE_MAX_TEMPERATURE = 0.5
+    # generate() et stream() ne lèvent pas: les erreurs sont rendues en texte avec ce préfixe
+    ERROR_PREFIX = "❌"
+    
     def __init__(self, api_key: str, model: str = "gemini-2.5-flash"):
         """Initialise le service"""
         genai.configure(api_key=api_key)
         self.model = genai.GenerativeModel(model)
         self.model_name = model
+        self._cache: OrderedDict = OrderedDict()
+    
+    @classmethod
+    def is_error(cls, text: str) -> bool:
+        """Vrai si le texte est un message d'erreur rendu par generate() / stream()"""
+        return text.startswith(cls.ERROR_PREFIX)
+    
+    def _cache_key(self, prompt: str, temperature: float, max_tokens: int) -> Optional[tuple]:
+        if temperature > self.CACHE_MAX_TEMPERATURE:
+            return None
+        return (self.model_name, temperature, max_tokens, hashlib.sha256(prompt.encode('utf-8')).digest())
+    
+    def _cache_get(self, key: tuple) -> Optional[str]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires_at, text = entry
+        if expires_at < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return text
+    
+    def _cache_put(self, key: tuple, text: str):
+        self._cache[key] = (time.monotonic() + self.CACHE_TTL, text)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.CACHE_SIZE:
+            self._cache.popitem(last=False)
     
     def generate(self, prompt: str, temperature: float = 0.5, max_tokens: int = 2048) -> str:
         """Génère une réponse complète (non-streaming) - SIMPLE ET DIRECT"""
-        import sys
+        cache_key = self._cache_key(prompt, temperature, max_tokens)
+        if cache_key is not None:
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                return cached
+        
         try:
-            print(f"  🔍 [GEMINI] Sending request to API...", flush=True)
-            sys.stdout.flush()
-            print(f"  🔍 [GEMINI] Model: {self.model_name}", flush=True)
-            print(f"  🔍 [GEMINI] Prompt length: {len(prompt)}", flush=True)
-            sys.stdout.flush()
-            
-            print(f"  🔍 [GEMINI] Calling generate_content()...", flush=True)
-            sys.stdout.flush()
+            logger.debug("[GEMINI] generate_content model=%s prompt=%d chars", self.model_name, len(prompt))
             
             response = self.model.generate_content(
                 prompt,
@@ -36,14 +75,14 @@ class GeminiService:
                 )
             )
             
-            print(f"  🔍 [GEMINI] Response received! Length: {len(response.text)}", flush=True)
-            sys.stdout.flush()
+            logger.debug("[GEMINI] Response received: %d chars", len(response.text))
+            if cache_key is not None:
+                self._cache_put(cache_key, response.text)
             return response.text
             
         except Exception as e:
             error_msg = str(e)
-            print(f"  ❌ [GEMINI] Error: {type(e).__name__}: {error_msg[:100]}", flush=True)
-            sys.stdout.flush()
+            logger.warning("[GEMINI] %s: %s", type(e).__name__, error_msg[:100])
             
             # Détect quota errors
             if "429" in error_msg or "exceeded" in error_msg.lower() or "quota" in error_msg.lower():
@@ -69,12 +108,12 @@ class GeminiService:
                 if chunk.text:
                     yield chunk.text
         except Exception as e:
-            yield f"Erreur Gemini: {str(e)}"
+            yield f"❌ Erreur Gemini: {str(e)}"
     
-    async def stream_async(self, prompt: str, temperature: float = 0.7, max_tokens: int = 2048) -> Generator[str, None, None]:
-        """Streaming asynchrone"""
+    async def stream_async(self, prompt: str, temperature: float = 0.7, max_tokens: int = 2048) -> AsyncGenerator[str, None]:
+        """Streaming asynchrone (API async native du SDK, non bloquante)"""
         try:
-            response = self.model.generate_content(
+            response = await self.model.generate_content_async(
                 prompt,
                 generation_config=genai.types.GenerationConfig(
                     temperature=temperature,
@@ -83,9 +122,8 @@ class GeminiService:
                 stream=True
             )
             
-            for chunk in response:
+            async for chunk in response:
                 if chunk.text:
                     yield chunk.text
-                    await asyncio.sleep(0)
         except Exception as e:
-            yield f"Erreur Gemini: {str(e)}"
+            yield f"❌ Erreur Gemini: {str(e)}"
@@ -1,23 +1,85 @@
 """Service pour traitement PDF"""
-import pdfplumber
+from pdfminer.converter import TextConverter
+from pdfminer.layout import LAParams
+from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+from pdfminer.pdfpage import PDFPage
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import io
+from itertools import repeat
+import multiprocessing as mp
+import os
 from typing import List, Dict
 import re
 
+
+_WS_RE = re.compile(r'\s+')
+# Caractères de contrôle à supprimer (table C pour str.translate)
+_CTRL_TABLE = dict.fromkeys([*range(0x00, 0x09), 0x0B, 0x0C, *range(0x0E, 0x20), 0x7F])
+
+
+def _count_pages(pdf_path: str) -> int:
+    """Nombre de pages (parcours de l'arbre des pages, sans interpréter le contenu)"""
+    with open(pdf_path, 'rb') as fp:
+        return sum(1 for _ in PDFPage.get_pages(fp))
+
+
+def _extract_range(pdf_path: str, start: int, end: int) -> Dict[int, str]:
+    """Extrait les pages [start, end) (worker picklable, 1-indexed en sortie)
+    
+    API bas niveau de pdfminer: un seul gestionnaire de ressources (polices en
+    cache), convertisseur et interpréteur réutilisés pour toutes les pages,
+    sans le graphe d'objets char/mot/ligne de pdfplumber.
+    """
+    pages_text = {}
+    rsrcmgr = PDFResourceManager(caching=True)
+    buffer = io.StringIO()
+    device = TextConverter(rsrcmgr, buffer, laparams=LAParams())
+    try:
+        interpreter = PDFPageInterpreter(rsrcmgr, device)
+        with open(pdf_path, 'rb') as fp:
+            pages = PDFPage.get_pages(fp, pagenos=set(range(start, end)))
+            # Utiliser 1-indexed (page 1, 2, 3, ...) au lieu de 0-indexed
+            for page_num, page in enumerate(pages, start + 1):
+                interpreter.process_page(page)
+                # TextConverter termine chaque page par un saut de page
+                pages_text[page_num] = buffer.getvalue().rstrip('\x0c')
+                buffer.seek(0)
+                buffer.truncate(0)
+    finally:
+        device.close()
+    return pages_text
+
 class PDFProcessor:
     """Service pour extraction et traitement PDF"""
     
+    # En dessous, le coût de démarrage des workers dépasse le gain
+    MIN_PAGES_PARALLEL = 16
+    MIN_PAGES_PER_WORKER = 4
+    
     @staticmethod
     def extract_text_from_pdf(pdf_path: str) -> Dict[int, str]:
-        """Extrait texte par page (1-indexed pour l'utilisateur)"""
+        """Extrait texte par page (1-indexed pour l'utilisateur)
+        
+        Les gros PDF sont découpés en plages de pages réparties sur un pool
+        de processus (pdfminer est CPU-bound et sérialisé par le GIL).
+        """
         pages_text = {}
         
         try:
-            with pdfplumber.open(pdf_path) as pdf:
-                for i, page in enumerate(pdf.pages):
-                    text = page.extract_text()
-                    # Utiliser 1-indexed (page 1, 2, 3, ...) au lieu de 0-indexed
-                    pages_text[i + 1] = text if text else ""
+            n_pages = _count_pages(pdf_path)
+            
+            workers = min(os.cpu_count() or 1, n_pages // PDFProcessor.MIN_PAGES_PER_WORKER)
+            if n_pages < PDFProcessor.MIN_PAGES_PARALLEL or workers < 2:
+                return _extract_range(pdf_path, 0, n_pages)
+            
+            step = max(PDFProcessor.MIN_PAGES_PER_WORKER, -(-n_pages // workers))
+            starts = range(0, n_pages, step)
+            ends = [min(start + step, n_pages) for start in starts]
+            # spawn: appelé depuis un thread, fork pourrait hériter de verrous tenus
+            with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn')) as executor:
+                for part in executor.map(_extract_range, repeat(pdf_path), starts, ends):
+                    pages_text.update(part)
         except Exception as e:
             print(f"Erreur extraction PDF: {e}")
         
@@ -26,30 +88,38 @@ class PDFProcessor:
     @staticmethod
     def clean_text(text: str) -> str:
         """Nettoie et normalise texte"""
-        # Enlever espaces multiples
-        text = re.sub(r'\s+', ' ', text)
-        # Enlever caractères spéciaux problématiques
-        text = re.sub(r'[\x00-\x08\x0B-\x0C\x0E-\x1F\x7F]', '', text)
-        return text.strip()
+        # Enlever espaces multiples, puis caractères de contrôle problématiques
+        return _WS_RE.sub(' ', text).translate(_CTRL_TABLE).strip()
     
     @staticmethod
     def chunk_text(text: str, chunk_size: int = 500, overlap: int = 100) -> List[str]:
         """Crée chunks avec overlap"""
         chunks = []
-        sentences = text.split('. ')
-        
-        current_chunk = ""
-        for sentence in sentences:
-            if len(current_chunk) + len(sentence) < chunk_size:
-                current_chunk += sentence + ". "
+        # Chunk courant = prefix + text[start:end] + ". " : les phrases étant
+        # séparées par exactement ". " dans text, une tranche remplace la
+        # concaténation phrase par phrase
+        prefix = ""
+        start = end = None
+        current_len = 0
+        pos = 0
+        for sentence in text.split('. '):
+            sentence_start, sentence_end = pos, pos + len(sentence)
+            pos = sentence_end + 2
+            if current_len + len(sentence) < chunk_size:
+                if start is None:
+                    start = sentence_start
+                end = sentence_end
+                current_len += len(sentence) + 2
             else:
-                if current_chunk:
+                if start is not None:
+                    current_chunk = prefix + text[start:end] + ". "
                     chunks.append(current_chunk.strip())
-                # Overlap: garder fin du chunk précédent
-                overlap_text = current_chunk[-overlap:] if len(current_chunk) > overlap else ""
-                current_chunk = overlap_text + sentence + ". "
+                    # Overlap: garder fin du chunk précédent
+                    prefix = current_chunk[-overlap:] if len(current_chunk) > overlap else ""
+                start, end = sentence_start, sentence_end
+                current_len = len(prefix) + len(sentence) + 2
         
-        if current_chunk:
-            chunks.append(current_chunk.strip())
+        if start is not None:
+            chunks.append((prefix + text[start:end] + ". ").strip())
         
         return chunks
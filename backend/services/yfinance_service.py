@@ -4,6 +4,37 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Dict, List
 import pandas as pd
 from datetime import datetime, timedelta
+import threading
+import time
+
+# Requêtes Yahoo simultanées max (au-delà: rate-limiting)
+_YAHOO_SEMAPHORE = threading.Semaphore(4)
+_INFO_TTL = 15 * 60  # secondes
+_info_cache: Dict[str, tuple] = {}
+_info_lock = threading.Lock()
+# Historiques par (ticker, période en mois): re-sélectionner un ticker ne refait pas l'appel
+_HISTORY_TTL = 60 * 60  # secondes
+_history_cache: Dict[tuple, tuple] = {}
+_history_lock = threading.Lock()
+_PRICE_COLUMNS = ('Open', 'High', 'Low', 'Close')
+# Colonnes gardées de Ticker.history (Dividends / Stock Splits écartées)
+_OHLCV_COLUMNS = _PRICE_COLUMNS + ('Volume',)
+
+
+def _get_info(ticker: str) -> Dict:
+    """`yf.Ticker(ticker).info` mis en cache 15 minutes"""
+    now = time.monotonic()
+    with _info_lock:
+        entry = _info_cache.get(ticker)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+    
+    with _YAHOO_SEMAPHORE:
+        info = yf.Ticker(ticker).info
+    with _info_lock:
+        _info_cache[ticker] = (now + _INFO_TTL, info)
+    return info
+
 
 class YFinanceService:
     """Service pour fetch données Yahoo Finance"""
@@ -12,21 +43,19 @@ class YFinanceService:
     def fetch_ticker_data(ticker: str, start_date: datetime, end_date: datetime) -> Dict:
         """Récupère données pour 1 ticker"""
         try:
-            df = yf.download(ticker, start=start_date, end=end_date, progress=False)
+            # Ticker.history plutôt que yf.download: download passe par des globales
+            # du module (shared._DFS/_ERRORS) remises à zéro à chaque appel, ce qui
+            # mélange ou perd les résultats d'appels concurrents
+            with _YAHOO_SEMAPHORE:
+                df = yf.Ticker(ticker).history(start=start_date, end=end_date)
+            df = df[[col for col in _OHLCV_COLUMNS if col in df.columns]]
             
-            # Handle multi-index columns from yfinance
-            # yfinance returns MultiIndex like: [('Close', 'AAPL'), ('High', 'AAPL'), ...]
-            if isinstance(df.columns, pd.MultiIndex):
-                # Get all unique price types in level 0
-                price_types = df.columns.get_level_values(0).unique().tolist()
-                
-                # Select columns for this ticker and flatten
-                new_df = pd.DataFrame(index=df.index)
-                for price_type in price_types:
-                    new_df[price_type] = df[(price_type, ticker)]
-                df = new_df
+            # Cours en float32 (2 décimales utiles): historique en cache, session
+            # et payload Plotly divisés par deux; le volume reste en int64
+            price_cols = [col for col in _PRICE_COLUMNS if col in df.columns]
+            df = df.astype({col: 'float32' for col in price_cols})
             
-            info = yf.Ticker(ticker).info
+            info = _get_info(ticker)
             
             return {
                 'ticker': ticker,
@@ -46,17 +75,33 @@ class YFinanceService:
     
     @staticmethod
     def parallel_fetch_tickers(tickers: List[str], period_months: int = 20) -> Dict[str, pd.DataFrame]:
-        """Fetch tous les tickers - SÉQUENTIELLEMENT pour éviter les bugs yfinance"""
+        """Fetch tous les tickers en parallèle (I/O réseau, 4 requêtes max)"""
         end_date = datetime.now()
         start_date = end_date - timedelta(days=period_months * 30)
         
         data = {}
         
-        # NOTE: On utilise une approche séquentielle au lieu de ThreadPoolExecutor
-        # car yfinance a des problèmes avec la concurrence
-        for ticker in tickers:
-            result = YFinanceService.fetch_ticker_data(ticker, start_date, end_date)
+        def fetch_cached(ticker: str) -> Dict:
+            key = (ticker, period_months)
+            now = time.monotonic()
+            with _history_lock:
+                entry = _history_cache.get(key)
+            if entry is not None and entry[0] > now:
+                return entry[1]
             
+            result = YFinanceService.fetch_ticker_data(ticker, start_date, end_date)
+            # Les erreurs (réseau, rate-limit) et historiques vides (yfinance renvoie
+            # un DataFrame vide sur échec transitoire) ne sont pas mis en cache
+            if result['status'] == 'success' and not result['data'].empty:
+                with _history_lock:
+                    _history_cache[key] = (now + _HISTORY_TTL, result)
+            return result
+        
+        # map conserve l'ordre des tickers (couleurs/graphes stables)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(fetch_cached, tickers))
+        
+        for ticker, result in zip(tickers, results):
             if result['status'] == 'success':
                 data[ticker] = {
                     'dataframe': result['data'],
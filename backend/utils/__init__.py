@@ -1,56 +1,448 @@
 """Utilitaires pour embeddings et FAISS"""
 from sentence_transformers import SentenceTransformer
 import numpy as np
+import threading
 import faiss
-from typing import List
+from typing import Any, Hashable, List, Optional, Tuple
+from pathlib import Path
+import hashlib
+import logging
+import math
+import os
+import pickle
+import re
+import shutil
+import sqlite3
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
 
 class EmbeddingService:
     """Service pour embeddings avec SentenceTransformer"""
     
     _instance = None
     _model = None
+    # Modèle et backend réellement chargés (ONNX, repli PyTorch, fp16 GPU)
+    _model_tag = None
+    # Garde le premier chargement (ex: load_model dans un ThreadPoolExecutor)
+    _lock = threading.Lock()
+    BATCH_SIZE = 64
+    MODEL_NAME = 'all-MiniLM-L6-v2'
+    # CPU: export ONNX quantifié int8 (sentence-transformers >= 3.2); '' pour PyTorch
+    ONNX_FILE = os.environ.get('EMBEDDING_ONNX_FILE', 'onnx/model_quint8_avx2.onnx')
     
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super().__new__(cls)
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
         return cls._instance
     
-    def load_model(self, model_name: str = 'all-MiniLM-L6-v2'):
+    def load_model(self, model_name: str = MODEL_NAME):
         """Charge modèle SentenceTransformer (singleton)"""
         if self._model is None:
-            self._model = SentenceTransformer(model_name)
+            with self._lock:
+                if self._model is None:
+                    import torch
+                    if torch.cuda.is_available():
+                        model = SentenceTransformer(model_name, device='cuda')
+                        # Poids fp16 sur GPU; sorties reconverties en float32 pour FAISS
+                        model.half()
+                        backend = 'cuda-fp16'
+                    else:
+                        model, backend = self._load_cpu_model(model_name)
+                    self._model_tag = f"{model_name}|{backend}"
+                    self._model = model
+                    # Préchauffage: la première passe (allocations, noyaux) hors requête
+                    self._model.encode(["warmup"], show_progress_bar=False)
         return self._model
     
+    def _load_cpu_model(self, model_name: str) -> Tuple[SentenceTransformer, str]:
+        """(modèle, backend): ONNX Runtime int8 si disponible, sinon PyTorch"""
+        if self.ONNX_FILE:
+            try:
+                model = SentenceTransformer(
+                    model_name,
+                    device='cpu',
+                    backend='onnx',
+                    model_kwargs={'file_name': self.ONNX_FILE},
+                )
+                return model, f"onnx:{self.ONNX_FILE}"
+            except Exception as e:
+                logger.warning("Backend ONNX indisponible (%s), repli sur PyTorch", e)
+        return SentenceTransformer(model_name, device='cpu'), 'torch-cpu'
+    
+    def model_tag(self) -> str:
+        """Identité des vecteurs produits: modèle et backend effectivement chargés"""
+        if self._model is None:
+            self.load_model()
+        return self._model_tag
+    
     def get_embeddings(self, texts: List[str]) -> np.ndarray:
         """Génère embeddings pour une liste de textes"""
         if self._model is None:
             self.load_model()
         
-        embeddings = self._model.encode(texts, show_progress_bar=False)
-        return np.array(embeddings).astype('float32')
+        embeddings = self._model.encode(
+            texts,
+            batch_size=self.BATCH_SIZE,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        )
+        # float32 C-contigu: FAISS l'ingère sans copie
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
     
-    def get_embedding(self, text: str) -> np.ndarray:
-        """Génère embedding pour un texte unique"""
+    def get_embeddings_cached(self, texts: List[str]) -> np.ndarray:
+        """Comme get_embeddings, en ne calculant que les textes absents d'EmbeddingCache"""
+        if not texts:
+            return self.get_embeddings(texts)
+        
+        model_tag = self.model_tag()
+        keys = [EmbeddingCache.key_for_text(model_tag, text) for text in texts]
+        cached = EmbeddingCache.load_many(keys)
+        # Textes répétés (en-têtes, pieds de page, mentions légales): un seul encodage par clé
+        todo = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                todo.setdefault(key, text)
+        if not todo:
+            return np.vstack([cached[key] for key in keys])
+        
+        computed = self.get_embeddings(list(todo.values()))
+        EmbeddingCache.save_many(zip(todo, computed))
+        if len(todo) == len(texts):
+            return computed
+        
+        cached.update(zip(todo, computed))
+        return np.vstack([cached[key] for key in keys])
+    
+    def get_embeddings_batch(self, queries: List[str]) -> np.ndarray:
+        """Génère embeddings de plusieurs requêtes en une seule passe"""
         if self._model is None:
             self.load_model()
         
-        embedding = self._model.encode([text], show_progress_bar=False)
-        return np.array(embedding).astype('float32')[0]
+        embeddings = self._model.encode(
+            queries,
+            batch_size=max(len(queries), 1),
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        )
+        # float32 C-contigu: FAISS l'ingère sans copie
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
+    
+    def get_embedding(self, text: str) -> np.ndarray:
+        """Génère embedding pour un texte unique"""
+        return self.get_embeddings_batch([text])[0]
+
+def get_embedding_service() -> EmbeddingService:
+    """Instance partagée de EmbeddingService entre pipelines"""
+    return EmbeddingService()
 
 class FAISSService:
     """Service pour construction et requête FAISS"""
     
+    # Jusqu'à HNSW_THRESHOLD: exhaustif sq8; puis graphe HNSW; au-delà
+    # d'IVFPQ_THRESHOLD: index compressé IVF-PQ
+    HNSW_THRESHOLD = 10_000
+    IVFPQ_THRESHOLD = 100_000
+    HNSW_M = 32
+    HNSW_EF_CONSTRUCTION = 80
+    HNSW_EF_SEARCH = 32
+    _SQ_TYPES = {
+        'sq8': faiss.ScalarQuantizer.QT_8bit,
+        'fp16': faiss.ScalarQuantizer.QT_fp16,
+    }
+    NPROBE = 16
+    # Vecteurs normalisés L2: produit scalaire = similarité cosinus
+    METRIC = faiss.METRIC_INNER_PRODUCT
+    
     @staticmethod
-    def build_index(embeddings: np.ndarray) -> faiss.IndexFlatL2:
-        """Crée index FAISS"""
-        dimension = embeddings.shape[1]
-        index = faiss.IndexFlatL2(dimension)
+    def build_index(embeddings: np.ndarray, index_type: str = 'auto') -> faiss.Index:
+        """Crée index FAISS
+        
+        Args:
+            embeddings: Matrice (N, d) float32 C-contiguë (cf. get_embeddings)
+            index_type: 'flat' (exhaustif float32), 'sq8' / 'fp16' (exhaustif
+                quantifié), 'hnsw' (graphe ANN), 'ivfpq' (compressé) ou 'auto'
+                (sq8, hnsw si N > HNSW_THRESHOLD, ivfpq si N > IVFPQ_THRESHOLD)
+        
+        Les vecteurs sont normalisés L2 en place: les scores renvoyés par
+        search sont des similarités cosinus (plus grand = plus proche).
+        """
+        if embeddings.ndim != 2 or embeddings.dtype != np.float32 or not embeddings.flags.c_contiguous:
+            raise ValueError(
+                f"embeddings doit être une matrice (N, d) float32 C-contiguë, "
+                f"reçu {embeddings.dtype} {embeddings.shape}"
+            )
+        faiss.normalize_L2(embeddings)
+        n, dimension = embeddings.shape
+        if index_type == 'auto':
+            if n > FAISSService.IVFPQ_THRESHOLD:
+                index_type = 'ivfpq'
+            elif n > FAISSService.HNSW_THRESHOLD:
+                index_type = 'hnsw'
+            else:
+                index_type = 'sq8'
+        
+        if index_type == 'flat':
+            index = faiss.IndexFlatIP(dimension)
+        elif index_type in FAISSService._SQ_TYPES:
+            # Bornes min/max par dimension apprises sur le corpus
+            index = faiss.IndexScalarQuantizer(
+                dimension, FAISSService._SQ_TYPES[index_type], FAISSService.METRIC
+            )
+            index.train(embeddings)
+        elif index_type == 'hnsw':
+            index = faiss.IndexHNSWFlat(dimension, FAISSService.HNSW_M, FAISSService.METRIC)
+            index.hnsw.efConstruction = FAISSService.HNSW_EF_CONSTRUCTION
+        elif index_type == 'ivfpq':
+            # ~39 points d'entraînement par centroïde minimum (recommandation FAISS)
+            nlist = max(1, min(int(4 * math.sqrt(n)), n // 39))
+            index = faiss.index_factory(
+                dimension, f"IVF{nlist},PQ{dimension // 4}x8", FAISSService.METRIC
+            )
+            index.train(embeddings)
+        else:
+            raise ValueError(f"index_type inconnu: {index_type}")
+        
         index.add(embeddings)
         return index
     
     @staticmethod
-    def search(index: faiss.IndexFlatL2, query_embedding: np.ndarray, k: int = 5) -> tuple:
+    def search(index: faiss.Index, query_embedding: np.ndarray, k: int = 5) -> tuple:
         """Cherche k voisins les plus proches"""
-        query_embedding = np.array([query_embedding]).astype('float32')
-        distances, indices = index.search(query_embedding, k)
+        distances, indices = FAISSService.search_batch(index, np.array([query_embedding]), k)
         return distances[0], indices[0]
+    
+    @staticmethod
+    def search_batch(index: faiss.Index, query_embeddings: np.ndarray, k: int = 5) -> tuple:
+        """Cherche k voisins pour une matrice (Q, d) de requêtes en un appel"""
+        if hasattr(index, 'nprobe'):
+            index.nprobe = FAISSService.NPROBE
+        if hasattr(index, 'hnsw'):
+            index.hnsw.efSearch = FAISSService.HNSW_EF_SEARCH
+        query_embeddings = np.array(query_embeddings, dtype='float32', order='C')
+        faiss.normalize_L2(query_embeddings)
+        return index.search(query_embeddings, k)
+
+
+class SemanticCache:
+    """Réponses mémorisées par similarité de question (cosinus, index FAISS exact)
+    
+    Une question reformulée dont l'embedding (normalisé) dépasse THRESHOLD de
+    similarité avec une question déjà traitée, dans le même scope et avec les
+    mêmes nombres, réutilise sa réponse sans appel LLM. FIFO borné à MAX_ENTRIES.
+    """
+    
+    THRESHOLD = 0.95
+    MAX_ENTRIES = 256
+    # Voisins examinés (le plus proche peut appartenir à un autre scope)
+    SEARCH_K = 4
+    # "revenus T2 2023" / "revenus T3 2023", "page 12" / "page 14": embeddings
+    # quasi identiques, réponses différentes; les nombres doivent concorder
+    _NUMBER_RE = re.compile(r'\d+')
+    
+    def __init__(self, threshold: float = THRESHOLD, max_entries: int = MAX_ENTRIES):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._index: Optional[faiss.Index] = None
+        self._entries: List[Tuple[Hashable, Tuple[str, ...], Any]] = []
+        # Pipelines partagés entre sessions Streamlit
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _numbers(question: Optional[str]) -> Tuple[str, ...]:
+        """Nombres de la question, dans l'ordre (années, trimestres, pages...)"""
+        return tuple(SemanticCache._NUMBER_RE.findall(question)) if question else ()
+    
+    def get(self, query_embedding: np.ndarray, scope: Hashable = None, question: Optional[str] = None) -> Optional[Any]:
+        """Valeur de la question la plus proche au-delà du seuil, sinon None"""
+        numbers = self._numbers(question)
+        with self._lock:
+            if not self._entries:
+                return None
+            query = np.ascontiguousarray(query_embedding, dtype=np.float32).reshape(1, -1)
+            scores, ids = self._index.search(query, min(self.SEARCH_K, len(self._entries)))
+            for score, idx in zip(scores[0], ids[0]):
+                if score < self.threshold:
+                    break
+                entry_scope, entry_numbers, value = self._entries[idx]
+                if entry_scope == scope and entry_numbers == numbers:
+                    return value
+            return None
+    
+    def put(self, query_embedding: np.ndarray, value: Any, scope: Hashable = None, question: Optional[str] = None) -> None:
+        query = np.ascontiguousarray(query_embedding, dtype=np.float32).reshape(1, -1)
+        numbers = self._numbers(question)
+        with self._lock:
+            if self._index is None:
+                self._index = faiss.IndexFlatIP(query.shape[1])
+            if len(self._entries) >= self.max_entries:
+                # Les ids FAISS sont décalés comme la liste
+                self._index.remove_ids(np.arange(1, dtype=np.int64))
+                self._entries.pop(0)
+            self._index.add(query)
+            self._entries.append((scope, numbers, value))
+
+
+class IndexCache:
+    """Cache disque index FAISS + chunks, indexé par empreinte du contenu"""
+    
+    CACHE_DIR = Path(os.environ.get('RAG_CACHE_DIR', Path.home() / '.cache' / 'rag'))
+    INDEX_FILE = 'index.faiss'
+    CHUNKS_FILE = 'chunks.pkl'
+    # À incrémenter quand le format des index change (métrique, normalisation)
+    VERSION = 2
+    # Entrées gardées sur disque (les moins récemment utilisées sont supprimées)
+    MAX_ENTRIES = 32
+    
+    @staticmethod
+    def _root() -> Path:
+        return IndexCache.CACHE_DIR / f"v{IndexCache.VERSION}"
+    
+    @staticmethod
+    def _entry_dir(key: str) -> Path:
+        return IndexCache._root() / key
+    
+    @staticmethod
+    def key_for_model(key: str, model_tag: str) -> str:
+        """Clé liée à l'encodeur (EmbeddingService.model_tag): un autre modèle ou
+        backend ne relit pas un index construit avec d'autres vecteurs"""
+        return hashlib.sha256(f"{model_tag}\0{key}".encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def key_for_file(path: str, block_size: int = 1024 * 1024) -> str:
+        """SHA-256 d'un fichier lu par blocs"""
+        with open(path, 'rb') as f:
+            return IndexCache.key_for_fileobj(f, block_size)
+    
+    @staticmethod
+    def key_for_fileobj(fileobj, block_size: int = 1024 * 1024) -> str:
+        """SHA-256 d'un objet fichier binaire (ex: upload en mémoire), lu par blocs"""
+        digest = hashlib.sha256()
+        for block in iter(lambda: fileobj.read(block_size), b''):
+            digest.update(block)
+        return digest.hexdigest()
+    
+    @staticmethod
+    def key_for_texts(texts: List[str]) -> str:
+        """SHA-256 d'une liste de textes (ordre significatif)"""
+        digest = hashlib.sha256()
+        for text in texts:
+            digest.update(text.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+    
+    @staticmethod
+    def load(key: str) -> Optional[Tuple[faiss.Index, list]]:
+        """Recharge (index, chunks); index mappé en mémoire si possible"""
+        cache_dir = IndexCache._entry_dir(key)
+        index_path = cache_dir / IndexCache.INDEX_FILE
+        chunks_path = cache_dir / IndexCache.CHUNKS_FILE
+        if not (index_path.exists() and chunks_path.exists()):
+            return None
+        
+        try:
+            try:
+                index = faiss.read_index(str(index_path), faiss.IO_FLAG_MMAP)
+            except RuntimeError:
+                index = faiss.read_index(str(index_path))
+            with open(chunks_path, 'rb') as f:
+                chunks = pickle.load(f)
+            # mtime du répertoire = dernière utilisation (ordre d'éviction)
+            os.utime(cache_dir)
+            return index, chunks
+        except Exception as e:
+            logger.warning("Cache index illisible (%s): %s", key[:12], e)
+            return None
+    
+    @staticmethod
+    def save(key: str, index: faiss.Index, chunks: list) -> None:
+        """Écrit index et chunks (chunks en dernier: marque l'entrée complète)"""
+        cache_dir = IndexCache._entry_dir(key)
+        try:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            faiss.write_index(index, str(cache_dir / IndexCache.INDEX_FILE))
+            tmp_path = cache_dir / (IndexCache.CHUNKS_FILE + '.tmp')
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(chunks, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_dir / IndexCache.CHUNKS_FILE)
+            os.utime(cache_dir)
+            IndexCache._evict()
+        except Exception as e:
+            logger.exception("Erreur écriture cache index: %s", e)
+    
+    @staticmethod
+    def _evict() -> None:
+        """Supprime les entrées au-delà de MAX_ENTRIES, les moins récemment utilisées d'abord"""
+        entries = sorted(
+            (path for path in IndexCache._root().iterdir() if path.is_dir()),
+            key=lambda path: path.stat().st_mtime,
+            reverse=True,
+        )
+        for stale in entries[IndexCache.MAX_ENTRIES:]:
+            shutil.rmtree(stale, ignore_errors=True)
+
+
+class EmbeddingCache:
+    """Cache disque des embeddings de chunks (SQLite), indexé par SHA-256 du texte
+    
+    Complète IndexCache: un PDF différent qui partage des passages (version
+    révisée, mentions légales) ne ré-encode que ses chunks nouveaux.
+    """
+    
+    DB_FILE = 'embeddings.sqlite3'
+    # ~150 Mo en dimension 384; au-delà, les plus anciennes insertions sont supprimées
+    MAX_ROWS = 100_000
+    # Limite de paramètres SQLite par requête (999 sur les anciennes versions)
+    QUERY_BATCH = 500
+    
+    @staticmethod
+    def _connect() -> sqlite3.Connection:
+        IndexCache.CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(IndexCache.CACHE_DIR / EmbeddingCache.DB_FILE), timeout=10)
+        conn.execute("CREATE TABLE IF NOT EXISTS embeddings (hash BLOB PRIMARY KEY, vec BLOB NOT NULL)")
+        return conn
+    
+    @staticmethod
+    def key_for_text(model_tag: str, text: str) -> bytes:
+        """SHA-256 du (modèle, texte): un changement de modèle invalide les entrées"""
+        return hashlib.sha256(f"{model_tag}\0{text}".encode('utf-8')).digest()
+    
+    @staticmethod
+    def load_many(keys: List[bytes]) -> dict:
+        """{clé: vecteur float32} pour les clés présentes"""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        try:
+            with closing(EmbeddingCache._connect()) as conn:
+                for start in range(0, len(unique_keys), EmbeddingCache.QUERY_BATCH):
+                    batch = unique_keys[start:start + EmbeddingCache.QUERY_BATCH]
+                    placeholders = ','.join('?' * len(batch))
+                    rows = conn.execute(
+                        f"SELECT hash, vec FROM embeddings WHERE hash IN ({placeholders})", batch
+                    )
+                    for key, vec in rows:
+                        found[key] = np.frombuffer(vec, dtype=np.float32)
+        except Exception as e:
+            logger.warning("Cache embeddings illisible: %s", e)
+        return found
+    
+    @staticmethod
+    def save_many(items) -> None:
+        """Insère des (clé, vecteur) en une transaction; les clés existantes sont gardées"""
+        try:
+            with closing(EmbeddingCache._connect()) as conn, conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO embeddings (hash, vec) VALUES (?, ?)",
+                    ((key, np.asarray(vec, dtype=np.float32).tobytes()) for key, vec in items)
+                )
+                # rowid croissant à l'insertion: garder les MAX_ROWS plus récentes
+                conn.execute(
+                    "DELETE FROM embeddings WHERE rowid <= (SELECT MAX(rowid) FROM embeddings) - ?",
+                    (EmbeddingCache.MAX_ROWS,)
+                )
+        except Exception as e:
+            logger.exception("Erreur écriture cache embeddings: %s", e)
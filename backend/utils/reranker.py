@@ -1,39 +1,93 @@
 """Service de reranking avec CrossEncoder"""
 from sentence_transformers import CrossEncoder
-from typing import List, Dict
+from typing import List, Dict, Tuple
+from pathlib import Path
 import numpy as np
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
 
 class RerankerService:
     """Service pour reranking de documents"""
     
     _instance = None
     _model = None
+    # Garde le premier chargement (ex: load_model dans un ThreadPoolExecutor)
+    _lock = threading.Lock()
+    # 'onnx_int8': export ONNX quantifié dynamiquement (sentence-transformers >= 4.1)
+    BACKEND = os.environ.get('RERANKER_BACKEND', 'torch')
+    ONNX_DIR = Path(os.environ.get('RERANKER_ONNX_DIR', Path.home() / '.cache' / 'rag' / 'reranker-onnx'))
+    ONNX_QUANTIZATION = 'avx512_vnni'
     
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super().__new__(cls)
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
         return cls._instance
     
     def load_model(self, model_name: str = 'cross-encoder/mmarco-mMiniLMv2-L12-H384-v1'):
         """Charge modèle CrossEncoder (singleton)"""
         if self._model is None:
-            self._model = CrossEncoder(model_name)
+            with self._lock:
+                if self._model is None:
+                    if self.BACKEND == 'onnx_int8':
+                        self._model = self._load_onnx_int8(model_name)
+                    else:
+                        self._model = CrossEncoder(model_name)
         return self._model
     
-    def rerank(self, query: str, texts: List[str], top_k: int = 3) -> List[Dict]:
-        """Reranking des textes par pertinence"""
+    def _load_onnx_int8(self, model_name: str) -> CrossEncoder:
+        """CrossEncoder ONNX int8, exporté une fois dans ONNX_DIR; repli PyTorch"""
+        local_dir = self.ONNX_DIR / model_name.replace('/', '__')
+        file_name = f'onnx/model_qint8_{self.ONNX_QUANTIZATION}.onnx'
+        try:
+            if not (local_dir / file_name).exists():
+                from sentence_transformers import export_dynamic_quantized_onnx_model
+                
+                model = CrossEncoder(model_name, backend='onnx')
+                model.save_pretrained(str(local_dir))
+                export_dynamic_quantized_onnx_model(model, self.ONNX_QUANTIZATION, str(local_dir))
+            return CrossEncoder(str(local_dir), backend='onnx', model_kwargs={'file_name': file_name})
+        except Exception as e:
+            logger.warning("Reranker ONNX int8 indisponible (%s), repli sur PyTorch", e)
+            return CrossEncoder(model_name)
+    
+    def rerank_indices(self, query: str, texts: List[str], top_k: int = 3) -> Tuple[np.ndarray, np.ndarray]:
+        """Indices et scores des top_k textes, par score décroissant"""
         if self._model is None:
             self.load_model()
         
-        pairs = [[query, text] for text in texts]
-        scores = self._model.predict(pairs)
+        if not texts or top_k <= 0:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
         
-        # Trier par score décroissant
-        ranked = sorted(
-            [{'text': text, 'score': score, 'index': i} 
-             for i, (text, score) in enumerate(zip(texts, scores))],
-            key=lambda x: x['score'],
-            reverse=True
+        pairs = [[query, text] for text in texts]
+        scores = self._model.predict(
+            pairs,
+            batch_size=len(pairs),
+            convert_to_numpy=True,
+            show_progress_bar=False,
         )
         
-        return ranked[:top_k]
+        # Sélection O(n) des top_k, puis tri de ces seuls candidats
+        # (décroissant, ex-aequo dans l'ordre d'origine)
+        if top_k < len(scores):
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            top = np.arange(len(scores))
+        order = top[np.lexsort((top, -scores[top]))]
+        return order, scores[order]
+    
+    def rerank(self, query: str, texts: List[str], top_k: int = 3) -> List[Dict]:
+        """Reranking des textes par pertinence"""
+        order, scores = self.rerank_indices(query, texts, top_k)
+        return [
+            {'text': texts[i], 'score': score, 'index': int(i)}
+            for i, score in zip(order, scores)
+        ]
+
+def get_reranker_service() -> RerankerService:
+    """Instance partagée de RerankerService entre pipelines"""
+    return RerankerService()
@@ -1,34 +1,157 @@
 """Astrali - AI Financial Assistant RAG - ChatGPT-like UI"""
 import streamlit as st
-import pandas as pd
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+from streamlit.errors import StreamlitAPIException
 from datetime import datetime, timedelta
 import sys
 from pathlib import Path
 import io
-from typing import Dict
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional, Tuple
+from functools import lru_cache
+from collections import OrderedDict, deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 import tempfile
-import html
-import markdown as md
+import hashlib
+import logging
+import os
 
 # Add backend to path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from backend.config import GeminiConfig
-from backend.rag import PDFRagPipeline
-from backend.rag.yfinance_rag import YFinanceRagAssistant
-from backend.services.gemini_service import GeminiService
+# Pipelines RAG (torch, faiss, pandas...), plotly et genai sont importés à la
+# demande: la page d'accueil n'en a pas besoin
 import re
-import google.generativeai as genai
+import threading
 import time
 
+# Logs backend (debug RAG/Gemini): LOG_LEVEL=DEBUG pour les activer
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper())
+
+# Format des clés Gemini (\Z: pas de \n final accepté, contrairement à $)
+_GEMINI_KEY_RE = re.compile(r'^AIza[0-9A-Za-z\-_]{35}\Z')
+
+@lru_cache(maxsize=1)
+def _genai():
+    import google.generativeai as genai
+    return genai
+
+# genai.configure est global et un client se lie à la clé configurée lors de son
+# premier appel: les services ne sont jamais partagés entre sessions
+def _get_gemini_service(api_key: str):
+    """GeminiService de la session pour cette clé (client et cache de réponses réutilisés)"""
+    services = st.session_state.setdefault('gemini_services', {})
+    service = services.get(api_key)
+    if service is None:
+        from backend.services.gemini_service import GeminiService
+        service = services[api_key] = GeminiService(api_key=api_key)
+    return service
+
 # ===== API VALIDATION FUNCTION =====
+# Échecs réseau/API mis en cache 60s seulement (réessai possible après un 429)
+_VALIDATION_FAILURE_TTL = 60
+
+def _failed_validation(message: str, error_type: str) -> Mapping:
+    return MappingProxyType({
+        'valid': False,
+        'message': message,
+        'service': None,
+        'error_type': error_type
+    })
+
+_EMPTY_KEY_RESULT = _failed_validation("La clé API ne peut pas être vide", 'empty')
+_BAD_FORMAT_RESULT = _failed_validation(
+    "Format de clé API invalide. Une clé Gemini commence par 'AIza'", 'format'
+)
+
+# Attente max d'un appel concurrent (timeout réseau de 10s + marge)
+_INFLIGHT_WAIT = 11
+_INFLIGHT_TIMEOUT_RESULT = _failed_validation(
+    "Délai de validation dépassé. Réessayez.", 'connection'
+)
+
+@st.cache_resource(show_spinner=False)
+def _inflight_validations():
+    """Validations en cours par clé, partagées entre sessions et reruns"""
+    return threading.Lock(), {}
+
+def check_key_format(api_key: str) -> Optional[Mapping]:
+    """Résultat d'échec (figé) si le format est invalide, None sinon - sans réseau"""
+    # 1. Check format
+    if not api_key or len(api_key.strip()) == 0:
+        return _EMPTY_KEY_RESULT
+    # 2. Check pattern (basic validation - Gemini keys start with 'AIza')
+    if not _GEMINI_KEY_RE.match(api_key.strip()):
+        return _BAD_FORMAT_RESULT
+    return None
+
+def _validation_cache_get(api_key: str) -> Optional[Mapping]:
+    cache = st.session_state.setdefault('api_validation_cache', {})
+    entry = cache.get(api_key)
+    if entry is None:
+        return None
+    result, expires_at = entry
+    if expires_at < time.monotonic():
+        del cache[api_key]
+        return None
+    return result
+
+def _validation_cache_put(api_key: str, result: Mapping):
+    ttl = float('inf') if result['valid'] else _VALIDATION_FAILURE_TTL
+    st.session_state.setdefault('api_validation_cache', {})[api_key] = (result, time.monotonic() + ttl)
+
+def validate_api_key_cached(api_key: str, spinner_text: str) -> Mapping:
+    """Format d'abord, puis cache de session, puis appel live sous spinner"""
+    result = check_key_format(api_key)
+    if result is not None:
+        return result
+    result = _validation_cache_get(api_key)
+    if result is None:
+        with st.spinner(spinner_text):
+            result = validate_api_key(api_key)
+        _validation_cache_put(api_key, result)
+    return result
+
 def validate_api_key(api_key: str) -> Dict[str, any]:
     """
     Validate Gemini API key with comprehensive checks.
     Returns: {'valid': bool, 'message': str, 'service': GeminiService or None}
     """
+    format_error = check_key_format(api_key)
+    if format_error is not None:
+        return dict(format_error)
+    
+    api_key = api_key.strip()
+    
+    # Un seul appel réseau par clé: les appels concurrents attendent son résultat
+    lock, inflight = _inflight_validations()
+    with lock:
+        entry = inflight.get(api_key)
+        owner = entry is None
+        if owner:
+            entry = inflight[api_key] = (threading.Event(), [])
+    event, result_box = entry
+    if not owner:
+        if not (event.wait(timeout=_INFLIGHT_WAIT) and result_box):
+            return dict(_INFLIGHT_TIMEOUT_RESULT)
+        result = dict(result_box[0])
+    else:
+        try:
+            result = _validate_api_key_live(api_key)
+            result_box.append(result)
+        finally:
+            with lock:
+                del inflight[api_key]
+            event.set()
+    
+    # Seul le verdict est partagé: chaque session crée son propre service
+    if result['valid']:
+        result = {**result, 'service': _get_gemini_service(api_key)}
+    return result
+
+def _validate_api_key_live(api_key: str) -> Dict[str, any]:
+    """Appel de test Gemini (la clé est déjà validée et nettoyée)"""
     validation_result = {
         'valid': False,
         'message': '',
@@ -36,26 +159,12 @@ def validate_api_key(api_key: str) -> Dict[str, any]:
         'error_type': None
     }
     
-    # 1. Check format
-    if not api_key or len(api_key.strip()) == 0:
-        validation_result['message'] = "La clé API ne peut pas être vide"
-        validation_result['error_type'] = 'empty'
-        return validation_result
-    
-    api_key = api_key.strip()
-    
-    # 2. Check pattern (basic validation - Gemini keys start with 'AIza')
-    if not re.match(r'^AIza[0-9A-Za-z\-_]{35}$', api_key):
-        validation_result['message'] = "Format de clé API invalide. Une clé Gemini commence par 'AIza'"
-        validation_result['error_type'] = 'format'
-        return validation_result
+    genai = _genai()
     
     # 3. Try to initialize and test the API
     try:
-        # Configure the API
+        # Test with a simple request (configure est global: modèle neuf, utilisé aussitôt)
         genai.configure(api_key=api_key)
-        
-        # Test with a simple request
         model = genai.GenerativeModel('gemini-2.5-flash')
         response = model.generate_content(
             "Respond with exactly: TEST_OK",
@@ -67,11 +176,9 @@ def validate_api_key(api_key: str) -> Dict[str, any]:
         )
         
         if response and response.text:
-            # API is valid and responding
-            service = GeminiService(api_key=api_key)
+            # API is valid and responding (service créé par l'appelant, pour sa session)
             validation_result['valid'] = True
             validation_result['message'] = "✅ Clé API valide et fonctionnelle"
-            validation_result['service'] = service
             return validation_result
         else:
             validation_result['message'] = "La réponse de l'API est vide. Vérifiez votre clé."
@@ -107,17 +214,102 @@ def validate_api_key(api_key: str) -> Dict[str, any]:
             validation_result['error_type'] = 'unknown'
         return validation_result
 
-# ===== MARKDOWN TO HTML CONVERSION =====
-def markdown_to_html(markdown_text):
-    """Convert markdown text to formatted HTML with CSS classes"""
+# ===== STATIC CSS =====
+STATIC_DIR = Path(__file__).with_name('static')
+
+@lru_cache(maxsize=None)
+def load_css(name: str) -> str:
+    """Feuille de style lue une seule fois par processus"""
+    return (STATIC_DIR / name).read_text(encoding='utf-8')
+
+@lru_cache(maxsize=None)
+def style_tag(name: str) -> str:
+    """Balise <style> prête à émettre (la feuille doit l'être à chaque rerun)"""
+    return f"<style>{load_css(name)}</style>"
+
+# ===== LANDING PAGE HTML =====
+# Étapes "Comment ça marche?" (une par colonne), construites une fois à l'import
+_LANDING_FEATURE_HTML = (
+    """
+    <div class="feature-box">
+        <h3>1️⃣ Connectez l'API</h3>
+        <p>Entrez votre clé API Google Gemini pour démarrer. C'est gratuit et sécurisé.</p>
+    </div>
+    """,
+    """
+    <div class="feature-box">
+        <h3>2️⃣ Choisissez un Mode</h3>
+        <p><strong>PDF:</strong> Upload des documents financiers<br>
+        <strong>YFinance:</strong> Analyse des données d'actions</p>
+    </div>
+    """,
+    """
+    <div class="feature-box">
+        <h3>3️⃣ Posez des Questions</h3>
+        <p>Interagissez avec Astrali pour obtenir des insights financiers profonds.</p>
+    </div>
+    """,
+)
+
+_LANDING_AUTHORS_HTML = """
+<div class="authors">
+    <h4>👥 Développé par</h4>
+    <p><strong>Fofana Ibrahim Seloh</strong> | <strong>Aya EL KOUACH</strong> | <strong>Mehdi Chanaa</strong></p>
+    <p style="font-size: 0.9em; opacity: 0.7;">Astrali v1.0 - Assistants Financiers Intelligents</p>
+</div>
+"""
+
+@lru_cache(maxsize=None)
+def landing_header_html() -> str:
+    """CSS de la page d'accueil et header, assemblés une fois par processus"""
+    return "".join((
+        style_tag('landing.css'),
+        '<div class="landing-header">',
+        "<h1>✨ Astrali</h1>",
+        "<p>Assistant Financier Intelligent avec Analyse IA</p>",
+        "</div>",
+    ))
+
+# ===== FRAGMENTS =====
+def rerun_fragment():
+    """Relance seulement le fragment courant (toute l'app lors d'un run complet)"""
     try:
-        # Convert markdown to HTML
-        html_content = md.markdown(markdown_text, extensions=['tables', 'codehilite', 'fenced_code'])
-        # Add markdown-content class wrapper
-        return f'<div class="markdown-content">{html_content}</div>'
-    except Exception as e:
-        # Fallback to escaped text if conversion fails
-        return f'<div class="markdown-content"><p>{html.escape(markdown_text)}</p></div>'
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+# ===== CHAT WINDOWING =====
+# Nombre de messages rendus par défaut (l'historique complet reste en session)
+CHAT_WINDOW = 50
+# Historique du chat PDF borné: les plus anciens messages sont oubliés
+PDF_CHAT_HISTORY_MAX = 200
+
+def chat_window_start(history_key: str) -> int:
+    """Index du premier message affiché; bouton pour charger les précédents"""
+    extra_key = f"{history_key}_window_extra"
+    extra = st.session_state.get(extra_key, 0)
+    start = max(0, len(st.session_state[history_key]) - CHAT_WINDOW - extra)
+    if start > 0:
+        if st.button(f"⬆️ Charger les messages précédents ({start})", key=f"{history_key}_load_more"):
+            st.session_state[extra_key] = extra + CHAT_WINDOW
+            st.rerun()
+    return start
+
+def source_links(sources) -> list:
+    """(libellé, aide, page) des boutons sources d'une réponse"""
+    links = []
+    for idx, source in enumerate(sources):
+        page_num = source.get('page', 1)
+        score = source.get('rerank_score', 0.5)
+        text = source.get('text', '')[:80]
+        
+        if score > 10:
+            relevance_pct = max(5, min(100, int(score / 10)))
+        else:
+            relevance_pct = max(5, min(100, int(score * 100)))
+        
+        links.append((f"[{idx+1}] p.{page_num}", f"{text}... ({relevance_pct}%)", page_num))
+    return links
 
 # ===== PAGE CONFIG =====
 st.set_page_config(
@@ -128,310 +320,7 @@ st.set_page_config(
 )
 
 # ===== MODERN STYLES (SLEEK & PROFESSIONAL) =====
-st.markdown("""
-<style>
-    * { margin: 0; padding: 0; box-sizing: border-box; }
-    
-    body {
-        background: linear-gradient(135deg, #f5f7ff 0%, #efe7ff 50%, #fff5f7 100%);
-        font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-        min-height: 100vh;
-    }
-    
-    .main {
-        max-width: 1400px;
-        margin: 0 auto;
-        padding: 1.5rem;
-        background: linear-gradient(180deg, #ffffff 0%, #f8f9fc 100%);
-        border-radius: 1.2rem;
-        box-shadow: 0 8px 32px rgba(102, 126, 234, 0.08);
-    }
-    
-    /* Header styling */
-    .header-container {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        color: white;
-        padding: 1.5rem;
-        border-radius: 0.8rem;
-        margin-bottom: 1.5rem;
-        box-shadow: 0 4px 15px rgba(102, 126, 234, 0.3);
-    }
-    
-    .header-title {
-        font-size: 2rem;
-        font-weight: 800;
-        margin: 0;
-        letter-spacing: -0.5px;
-    }
-    
-    .header-subtitle {
-        font-size: 0.95rem;
-        opacity: 0.95;
-        margin-top: 0.5rem;
-    }
-    
-    /* Card styling */
-    .card {
-        background: linear-gradient(135deg, #f8f9fa 0%, #eff2f7 100%);
-        border: 1px solid #e9ecef;
-        border-radius: 0.8rem;
-        padding: 1.2rem;
-        margin-bottom: 1rem;
-        box-shadow: 0 2px 8px rgba(102, 126, 234, 0.08);
-        transition: all 0.3s ease;
-    }
-    
-    .card:hover {
-        box-shadow: 0 6px 16px rgba(102, 126, 234, 0.12);
-        transform: translateY(-2px);
-    }
-    
-    /* Input area */
-    .input-container {
-        background: linear-gradient(135deg, #ffffff 0%, #f8f9fc 100%);
-        padding: 1.2rem;
-        border-radius: 0.8rem;
-        border: 2px solid #e9ecef;
-        margin-top: 1rem;
-        transition: all 0.3s;
-        box-shadow: inset 0 2px 4px rgba(0,0,0,0.02);
-    }
-    
-    .input-container:focus-within {
-        border-color: #667eea;
-        background: linear-gradient(135deg, #ffffff 0%, #f5f7ff 100%);
-        box-shadow: 0 4px 12px rgba(102, 126, 234, 0.15);
-    }
-    
-    /* Chat container - improved */
-    .chat-box {
-        height: 480px;
-        max-height: 480px;
-        overflow-y: auto;
-        padding: 1rem;
-        background: linear-gradient(180deg, #fafbfc 0%, #f0f2f6 100%);
-        border: 1px solid #e9ecef;
-        border-radius: 0.8rem;
-        display: flex;
-        flex-direction: column;
-        gap: 0.8rem;
-        scroll-behavior: smooth;
-        box-shadow: inset 0 2px 6px rgba(0,0,0,0.03);
-    }
-    
-    .chat-box::-webkit-scrollbar {
-        width: 8px;
-    }
-    
-    .chat-box::-webkit-scrollbar-track {
-        background: linear-gradient(180deg, #f1f3f5 0%, #e8ecf1 100%);
-        border-radius: 10px;
-    }
-    
-    .chat-box::-webkit-scrollbar-thumb {
-        background: linear-gradient(135deg, #667eea, #764ba2);
-        border-radius: 10px;
-        transition: background 0.3s;
-        box-shadow: inset 0 0 6px rgba(0,0,0,0.1);
-    }
-    
-    .chat-box::-webkit-scrollbar-thumb:hover {
-        background: linear-gradient(135deg, #5a67d8, #6b3fa0);
-    }
-    
-    /* Message styling */
-    .msg-user {
-        display: flex;
-        justify-content: flex-end;
-        animation: slideInRight 0.3s ease;
-    }
-    
-    .msg-assistant {
-        display: flex;
-        justify-content: flex-start;
-        animation: slideInLeft 0.3s ease;
-    }
-    
-    @keyframes slideInRight {
-        from { opacity: 0; transform: translateX(10px); }
-        to { opacity: 1; transform: translateX(0); }
-    }
-    
-    @keyframes slideInLeft {
-        from { opacity: 0; transform: translateX(-10px); }
-        to { opacity: 1; transform: translateX(0); }
-    }
-    
-    /* Buttons */
-    .btn-primary {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        color: white;
-        padding: 0.6rem 1.2rem;
-        border: none;
-        border-radius: 0.6rem;
-        font-weight: 600;
-        cursor: pointer;
-        transition: all 0.2s;
-        box-shadow: 0 4px 12px rgba(102, 126, 234, 0.3);
-    }
-    
-    .btn-primary:hover {
-        transform: translateY(-3px);
-        box-shadow: 0 6px 16px rgba(102, 126, 234, 0.4);
-    }
-    
-    .btn-primary:active {
-        transform: translateY(-1px);
-    }
-    
-    /* Section headers */
-    .section-header {
-        font-size: 1.1rem;
-        font-weight: 700;
-        color: #667eea;
-        margin-bottom: 1rem;
-        padding-bottom: 0.8rem;
-        border-bottom: 3px solid #e9ecef;
-        background: linear-gradient(90deg, #f5f7ff 0%, transparent 100%);
-        padding-left: 0.5rem;
-    }
-    
-    /* Info boxes */
-    .info-box {
-        background: linear-gradient(135deg, #e3f2fd 0%, #f3e5f5 100%);
-        border-left: 4px solid #667eea;
-        padding: 1.2rem;
-        border-radius: 0.6rem;
-        margin: 1rem 0;
-        box-shadow: 0 2px 8px rgba(102, 126, 234, 0.1);
-    }
-    
-    .chat-responses-container::-webkit-scrollbar-thumb {
-        background: #667eea;
-        border-radius: 10px;
-    }
-    
-    .chat-responses-container::-webkit-scrollbar-thumb:hover {
-        background: #764ba2;
-    }
-    
-    /* Chat input area - fixed at bottom */
-    .chat-input-area {
-        margin-top: 0.75rem;
-        padding-top: 0.5rem;
-        border-top: 1px solid #f0f0f0;
-        background: linear-gradient(180deg, transparent 0%, #f5f7ff 100%);
-    }
-    
-    /* Markdown content formatting in chat */
-    .markdown-content h1, .markdown-content h2, .markdown-content h3, 
-    .markdown-content h4, .markdown-content h5, .markdown-content h6 {
-        margin: 1rem 0 0.5rem 0;
-        font-weight: 700;
-        color: #1a1a1a;
-    }
-    .markdown-content h1 { font-size: 1.5rem; color: #667eea; }
-    .markdown-content h2 { font-size: 1.25rem; color: #764ba2; }
-    .markdown-content h3 { font-size: 1.1rem; color: #667eea; }
-    
-    .markdown-content ul, .markdown-content ol {
-        margin: 0.5rem 0 0.5rem 1.5rem;
-        padding-left: 0;
-    }
-    .markdown-content li {
-        margin-bottom: 0.3rem;
-        color: #333;
-    }
-    
-    .markdown-content code {
-        background: linear-gradient(135deg, #e8eef7 0%, #f5e8f7 100%);
-        color: #764ba2;
-        padding: 0.3rem 0.6rem;
-        border-radius: 0.4rem;
-        font-family: 'Monaco', 'Menlo', monospace;
-        font-size: 0.9em;
-        border: 1px solid #e0d5ec;
-    }
-    
-    .markdown-content pre {
-        background: linear-gradient(135deg, #f5f5f5 0%, #eff1f5 100%);
-        border-left: 4px solid #667eea;
-        padding: 1rem;
-        border-radius: 0.6rem;
-        overflow-x: auto;
-        margin: 0.8rem 0;
-        box-shadow: inset 0 2px 6px rgba(0,0,0,0.04);
-    }
-    
-    .markdown-content strong, .markdown-content b {
-        font-weight: 700;
-        color: #667eea;
-    }
-    
-    .markdown-content em, .markdown-content i {
-        font-style: italic;
-        color: #764ba2;
-    }
-    
-    .markdown-content table {
-        border-collapse: collapse;
-        width: 100%;
-        margin: 0.8rem 0;
-        background: white;
-        border-radius: 0.6rem;
-        overflow: hidden;
-        box-shadow: 0 2px 8px rgba(0,0,0,0.05);
-    }
-    .markdown-content th, .markdown-content td {
-        border: 1px solid #e8ecf4;
-        padding: 0.8rem;
-        text-align: left;
-    }
-    .markdown-content th {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        color: white;
-        font-weight: 600;
-    }
-    .markdown-content tr:nth-child(even) {
-        background: #f8f9fc;
-    }
-    
-    .markdown-content blockquote {
-        border-left: 4px solid #667eea;
-        padding-left: 1rem;
-        margin: 0.8rem 0;
-        color: #555;
-        font-style: italic;
-        background: linear-gradient(90deg, #f5f7ff 0%, transparent 100%);
-        padding: 0.8rem 1rem;
-        border-radius: 0.4rem;
-    }
-    
-    .markdown-content a {
-        color: #667eea;
-        text-decoration: none;
-        transition: all 0.2s;
-        font-weight: 600;
-    }
-    .markdown-content a:hover {
-        color: #764ba2;
-        text-decoration: underline;
-    }
-    
-    .markdown-content p {
-        margin: 0.6rem 0;
-        line-height: 1.7;
-        color: #444;
-    }
-    
-    .markdown-content hr {
-        border: none;
-        border-top: 2px solid #667eea;
-        margin: 1.2rem 0;
-        opacity: 0.5;
-    }
-</style>
-""", unsafe_allow_html=True)
+st.markdown(style_tag('astrali.css'), unsafe_allow_html=True)
 
 # ===== SESSION INITIALIZATION =====
 if 'pdf_rag' not in st.session_state:
@@ -440,8 +329,16 @@ if 'pdf_file' not in st.session_state:
     st.session_state.pdf_file = None
 if 'pdf_file_name' not in st.session_state:
     st.session_state.pdf_file_name = None
+if 'pdf_file_hash' not in st.session_state:
+    st.session_state.pdf_file_hash = None
+if 'pdf_upload_id' not in st.session_state:
+    st.session_state.pdf_upload_id = None
+if 'pdf_bytes' not in st.session_state:
+    st.session_state.pdf_bytes = None
+if 'pdf_size_mb' not in st.session_state:
+    st.session_state.pdf_size_mb = 0.0
 if 'pdf_chat_history' not in st.session_state:
-    st.session_state.pdf_chat_history = []
+    st.session_state.pdf_chat_history = deque(maxlen=PDF_CHAT_HISTORY_MAX)
 if 'current_pdf_page' not in st.session_state:
     st.session_state.current_pdf_page = 1
 if 'pdf_zoom_level' not in st.session_state:
@@ -450,6 +347,10 @@ if 'pdf_viewer_active' not in st.session_state:
     st.session_state.pdf_viewer_active = False
 if 'pdf_viewer_visible' not in st.session_state:
     st.session_state.pdf_viewer_visible = True
+if 'pdf_stats_html' not in st.session_state:
+    st.session_state.pdf_stats_html = None
+if 'pdf_total_pages' not in st.session_state:
+    st.session_state.pdf_total_pages = 1
 if 'temp_pdf_path' not in st.session_state:
     st.session_state.temp_pdf_path = None
 
@@ -475,90 +376,8 @@ if not st.session_state.gemini_service:
     # Page de présentation
     st.set_page_config(page_title="Astrali - Assistant Financier IA", layout="wide")
     
-    # Header avec gradient
-    st.markdown("""
-    <style>
-        /* Full width container */
-        .block-container {
-            max-width: 100%;
-            padding: 2rem 3rem;
-        }
-        
-        .landing-header {
-            text-align: center;
-            padding: 50px 40px;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            border-radius: 15px;
-            margin-bottom: 40px;
-            box-shadow: 0 8px 32px rgba(102, 126, 234, 0.2);
-        }
-        .landing-header h1 {
-            color: white;
-            font-size: 3.5em;
-            margin: 0;
-            text-shadow: 2px 2px 4px rgba(0,0,0,0.3);
-            letter-spacing: -1px;
-        }
-        .landing-header p {
-            color: rgba(255,255,255,0.95);
-            font-size: 1.3em;
-            margin-top: 15px;
-            font-weight: 500;
-        }
-        .feature-box {
-            background: linear-gradient(135deg, #f8f9fa 0%, #eff2f7 100%);
-            padding: 30px;
-            border-radius: 12px;
-            margin: 20px 0;
-            border-left: 5px solid #667eea;
-            box-shadow: 0 2px 8px rgba(102, 126, 234, 0.08);
-            transition: all 0.3s ease;
-        }
-        .feature-box:hover {
-            box-shadow: 0 6px 16px rgba(102, 126, 234, 0.15);
-            transform: translateY(-2px);
-        }
-        .feature-box h3 {
-            margin-top: 0;
-            color: #667eea;
-            font-size: 1.2em;
-        }
-        .feature-box p {
-            margin: 10px 0;
-            color: #555;
-            line-height: 1.6;
-        }
-        .authors {
-            background: linear-gradient(135deg, #fff3cd 0%, #fff8e1 100%);
-            padding: 25px;
-            border-radius: 12px;
-            margin-top: 40px;
-            text-align: center;
-            border: 2px solid #ffc107;
-            box-shadow: 0 4px 12px rgba(255, 193, 7, 0.15);
-        }
-        .authors h4 {
-            margin-top: 0;
-            color: #856404;
-            font-size: 1.1em;
-        }
-        .authors p {
-            margin: 8px 0;
-            color: #856404;
-        }
-        
-        /* Wide layout enhancements */
-        .main-content {
-            margin: 0 auto;
-            padding: 0 20px;
-        }
-    </style>
-    
-    <div class="landing-header">
-        <h1>✨ Astrali</h1>
-        <p>Assistant Financier Intelligent avec Analyse IA</p>
-    </div>
-    """, unsafe_allow_html=True)
+    # Styles + header avec gradient en un seul élément
+    st.markdown(landing_header_html(), unsafe_allow_html=True)
     
     # Description
     col1, col2 = st.columns([1, 1])
@@ -590,32 +409,9 @@ if not st.session_state.gemini_service:
     # Fonctionnement
     st.markdown("### 📚 Comment ça marche?")
     
-    col1, col2, col3 = st.columns(3)
-    
-    with col1:
-        st.markdown("""
-        <div class="feature-box">
-            <h3>1️⃣ Connectez l'API</h3>
-            <p>Entrez votre clé API Google Gemini pour démarrer. C'est gratuit et sécurisé.</p>
-        </div>
-        """, unsafe_allow_html=True)
-    
-    with col2:
-        st.markdown("""
-        <div class="feature-box">
-            <h3>2️⃣ Choisissez un Mode</h3>
-            <p><strong>PDF:</strong> Upload des documents financiers<br>
-            <strong>YFinance:</strong> Analyse des données d'actions</p>
-        </div>
-        """, unsafe_allow_html=True)
-    
-    with col3:
-        st.markdown("""
-        <div class="feature-box">
-            <h3>3️⃣ Posez des Questions</h3>
-            <p>Interagissez avec Astrali pour obtenir des insights financiers profonds.</p>
-        </div>
-        """, unsafe_allow_html=True)
+    for col, feature_html in zip(st.columns(3), _LANDING_FEATURE_HTML):
+        with col:
+            st.markdown(feature_html, unsafe_allow_html=True)
     
     st.markdown("---")
     
@@ -659,13 +455,7 @@ if not st.session_state.gemini_service:
     """)
     
     # Authors
-    st.markdown("""
-    <div class="authors">
-        <h4>👥 Développé par</h4>
-        <p><strong>Fofana Ibrahim Seloh</strong> | <strong>Aya EL KOUACH</strong> | <strong>Mehdi Chanaa</strong></p>
-        <p style="font-size: 0.9em; opacity: 0.7;">Astrali v1.0 - Assistants Financiers Intelligents</p>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(_LANDING_AUTHORS_HTML, unsafe_allow_html=True)
     
     st.markdown("---")
     
@@ -705,20 +495,8 @@ if not st.session_state.gemini_service:
             
             # Real-time validation and feedback
             if api_key and len(api_key) > 5:  # Only validate if something is entered
-                # Show validation status
-                if 'api_validation_cache' not in st.session_state:
-                    st.session_state.api_validation_cache = {}
-                
-                # Check if we already validated this key
-                cached = st.session_state.api_validation_cache.get(api_key)
-                
-                if cached:
-                    result = cached
-                else:
-                    # Show validating indicator
-                    with st.spinner("🔍 Vérification de la clé..."):
-                        result = validate_api_key(api_key)
-                    st.session_state.api_validation_cache[api_key] = result
+                # Show validation status (format local, puis cache, puis API)
+                result = validate_api_key_cached(api_key, "🔍 Vérification de la clé...")
                 
                 # Display validation feedback
                 if result['valid']:
@@ -765,15 +543,13 @@ if not st.session_state.gemini_service:
                     st.error("⚠️ Veuillez entrer une clé API")
                 else:
                     # Validate the key
-                    with st.spinner("🔐 Validation en cours..."):
-                        result = validate_api_key(api_key)
+                    result = validate_api_key_cached(api_key, "🔐 Validation en cours...")
                     
                     if result['valid'] and result['service']:
                         st.session_state.gemini_service = result['service']
                         st.session_state.api_key_submitted = True
-                        st.balloons()
-                        st.success("✅ Bienvenue dans Astrali!")
-                        time.sleep(1)
+                        # Le toast survit au rerun: pas besoin d'attendre
+                        st.toast("✅ Bienvenue dans Astrali!", icon="✨")
                         st.rerun()
                     else:
                         st.error(f"❌ Connexion échouée\n\n**Raison:** {result['message']}")
@@ -827,8 +603,62 @@ with st.sidebar:
         mode = None
 
 # ===== GRAPHING FUNCTIONS =====
-def plot_single_ticker(df: pd.DataFrame, ticker: str) -> go.Figure:
+def _df_fingerprint(df):
+    """Clé de cache bon marché: forme, bornes de dates et dernier cours"""
+    if df.empty:
+        return (df.shape, None, None, None)
+    last_close = float(df['Close'].iloc[-1]) if 'Close' in df.columns else None
+    return (df.shape, str(df.index[0]), str(df.index[-1]), last_close)
+
+# Les figures ne changent que si les données changent: pas de reconstruction par rerun
+_FIG_CACHE = dict(ttl=24 * 60 * 60, show_spinner=False, hash_funcs={'pandas.core.frame.DataFrame': _df_fingerprint})
+
+# Couleurs des courbes du graphique comparatif
+_PALETTE = ('#FF6B6B', '#4ECDC4', '#45B7D1', '#FFA07A', '#98D8C8', '#F7DC6F', '#BB8FCE')
+
+# Tickers proposés dans le mode YFinance
+_TICKERS: Tuple[str, ...] = ('AAPL', 'MSFT', 'GOOGL', 'AMZN', 'TSLA')
+
+@lru_cache(maxsize=None)
+def _base_layout(kind: str) -> 'go.Layout':
+    """Layouts de base construits une fois (template résolu une seule fois)"""
+    import plotly.graph_objects as go
+    
+    if kind == 'single':
+        return go.Layout(
+            height=600,
+            hovermode='x unified',
+            template='plotly_white',
+            xaxis_rangeslider_visible=False
+        )
+    return go.Layout(
+        xaxis_title="Date",
+        yaxis_title="Prix (Base 100)",
+        height=700,
+        hovermode='x unified',
+        template='plotly_white',
+        plot_bgcolor='rgba(240, 240, 245, 0.5)',
+        paper_bgcolor='white',
+        font=dict(size=12, color='#333333'),
+        legend=dict(
+            x=0.01,
+            y=0.99,
+            bgcolor='rgba(255, 255, 255, 0.95)',
+            bordercolor='#333333',
+            borderwidth=2
+        ),
+        margin=dict(r=50, b=50),
+        xaxis=dict(gridwidth=1, gridcolor='rgba(128,128,128,0.2)'),
+        yaxis=dict(gridwidth=1, gridcolor='rgba(128,128,128,0.2)')
+    )
+
+@st.cache_data(**_FIG_CACHE)
+def plot_single_ticker(df: 'pd.DataFrame', ticker: str) -> 'go.Figure':
     """Graphique interactif pour un ticker"""
+    import pandas as pd
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+    
     if df is None or df.empty:
         return go.Figure().add_annotation(text=f"Pas de données pour {ticker}")
     
@@ -837,6 +667,11 @@ def plot_single_ticker(df: pd.DataFrame, ticker: str) -> go.Figure:
     if not all(col in df.columns for col in required_cols):
         return go.Figure().add_annotation(text=f"Colonnes manquantes pour {ticker}")
     
+    # float32 suffit pour des cours: payload Plotly (tableaux typés) divisé par deux
+    df = df.astype({col: 'float32' for col in required_cols})
+    if 'Volume' in df.columns:
+        df['Volume'] = pd.to_numeric(df['Volume'], downcast='integer')
+    
     # Créer figure avec subplots (Prix + Volume)
     fig = make_subplots(
         rows=2, cols=1,
@@ -873,24 +708,13 @@ def plot_single_ticker(df: pd.DataFrame, ticker: str) -> go.Figure:
         )
     
     # Layout
-    fig.update_layout(
-        title=f"{ticker} - Données historiques",
-        height=600,
-        hovermode='x unified',
-        template='plotly_white',
-        xaxis_rangeslider_visible=False
-    )
+    fig.update_layout(_base_layout('single'), title=f"{ticker} - Données historiques")
     
     return fig
 
 def plot_multiple_tickers(data_dict, tickers):
     """Graphique comparatif pour plusieurs tickers"""
-    fig = go.Figure()
-    
-    colors = ['#FF6B6B', '#4ECDC4', '#45B7D1', '#FFA07A', '#98D8C8', '#F7DC6F', '#BB8FCE']
-    
-    trace_count = 0
-    
+    frames = []
     for ticker in tickers:
         if ticker not in data_dict:
             continue
@@ -909,16 +733,35 @@ def plot_multiple_tickers(data_dict, tickers):
         if 'Close' not in df.columns:
             continue
         
-        # Normaliser prix (base 100)
-        first_price = df['Close'].iloc[0]
-        normalized = (df['Close'] / first_price) * 100
+        frames.append((ticker, df))
+    
+    return _build_multi_fig(tuple(frames), tuple(tickers))
+
+@st.cache_data(**_FIG_CACHE)
+def _build_multi_fig(frames: tuple, tickers: tuple) -> 'go.Figure':
+    import pandas as pd
+    import plotly.graph_objects as go
+    
+    fig = go.Figure()
+    
+    # Normaliser prix (base 100) en une passe sur un tableau large;
+    # les dates sont alignées, la base est le premier cours valide de chaque ticker
+    if frames:
+        closes = pd.concat({ticker: df['Close'] for ticker, df in frames}, axis=1).astype('float32')
+        normed = closes.div(closes.bfill().iloc[0]).mul(100)
+    
+    trace_count = 0
+    n_colors = len(_PALETTE)
+    
+    for ticker, _ in frames:
+        normalized = normed[ticker].dropna()
         
-        color = colors[trace_count % len(colors)]
+        color = _PALETTE[trace_count % n_colors]
         
         fig.add_trace(
             go.Scatter(
-                x=df.index,
-                y=normalized,
+                x=normalized.index,
+                y=normalized.to_numpy(),
                 name=f"{ticker}",
                 line=dict(color=color, width=3),
                 mode='lines+markers',
@@ -929,68 +772,143 @@ def plot_multiple_tickers(data_dict, tickers):
         trace_count += 1
     
     fig.update_layout(
-        title=f"Comparaison Multi-Tickers ({', '.join(tickers)}) - Prix normalisé base 100",
-        xaxis_title="Date",
-        yaxis_title="Prix (Base 100)",
-        height=700,
-        hovermode='x unified',
-        template='plotly_white',
-        plot_bgcolor='rgba(240, 240, 245, 0.5)',
-        paper_bgcolor='white',
-        font=dict(size=12, color='#333333'),
-        legend=dict(
-            x=0.01,
-            y=0.99,
-            bgcolor='rgba(255, 255, 255, 0.95)',
-            bordercolor='#333333',
-            borderwidth=2
-        ),
-        margin=dict(r=50, b=50),
-        xaxis=dict(gridwidth=1, gridcolor='rgba(128,128,128,0.2)'),
-        yaxis=dict(gridwidth=1, gridcolor='rgba(128,128,128,0.2)')
+        _base_layout('multi'),
+        title=f"Comparaison Multi-Tickers ({', '.join(tickers)}) - Prix normalisé base 100"
     )
     
     return fig
 
 # ===== PDF VIEWER FUNCTION =====
-def render_pdf_page(pdf_file, page_num: int, zoom_level: int = 100):
+@st.cache_resource(show_spinner=False, max_entries=3)
+def _open_pdf(file_hash: str, _pdf_bytes: bytes):
+    """Document PyMuPDF ouvert une fois par fichier, partagé entre reruns et sessions"""
+    import fitz
+    _, render_lock, _ = _pdf_prefetcher()
+    with render_lock:
+        return fitz.open(stream=_pdf_bytes, filetype="pdf")
+
+def _pdf_document(pdf_bytes: bytes, file_hash: str):
+    """Document partagé du fichier courant (nombre de pages mémorisé en session)"""
+    doc = _open_pdf(file_hash, pdf_bytes)
+    if st.session_state.get('pdf_doc_key') != file_hash:
+        st.session_state.pdf_doc_key = file_hash
+        # Compté une fois par fichier; render_pdf_page le renvoie tel quel
+        st.session_state.pdf_total_pages = doc.page_count
+    return doc
+
+# Pages rendues gardées en mémoire (tous fichiers et sessions confondus)
+_RASTER_CACHE_SIZE = 64
+
+@st.cache_resource(show_spinner=False)
+def _pdf_prefetcher():
+    """Thread de préchargement, verrou de rendu (PyMuPDF n'est pas thread-safe)
+    et LRU des pages rendues, partagés entre sessions"""
+    return (
+        ThreadPoolExecutor(max_workers=1, thread_name_prefix='pdf-prefetch'),
+        threading.Lock(),
+        OrderedDict(),
+    )
+
+# À partir de ce DPI, JPEG (payload bien plus léger); PNG en dessous, où les
+# artefacts JPEG se voient sur le texte
+_JPEG_MIN_DPI = 54
+_JPEG_QUALITY = 85
+
+def _rasterize(file_hash: str, page_num: int, dpi: int, doc, render_lock, pages: OrderedDict) -> bytes:
+    """Image encodée d'une page, en LRU par (empreinte du fichier, page, DPI)
+    
+    Sans API Streamlit: aussi exécutée par le thread de préchargement, qui n'a
+    pas de contexte de script (verrou et LRU lui sont passés en arguments).
+    """
+    key = (file_hash, page_num, dpi)
+    with render_lock:
+        img_bytes = pages.get(key)
+        if img_bytes is not None:
+            pages.move_to_end(key)
+            return img_bytes
+        pix = doc.load_page(page_num - 1).get_pixmap(dpi=dpi, alpha=False)
+        if dpi >= _JPEG_MIN_DPI:
+            img_bytes = pix.tobytes("jpeg", jpg_quality=_JPEG_QUALITY)
+        else:
+            img_bytes = pix.tobytes("png")
+        pages[key] = img_bytes
+        while len(pages) > _RASTER_CACHE_SIZE:
+            pages.popitem(last=False)
+    return img_bytes
+
+def _prefetch_neighbors(doc, file_hash: str, page_num: int, dpi: int):
+    """Pages voisines rendues en arrière-plan pendant la lecture de la page courante"""
+    executor, render_lock, pages = _pdf_prefetcher()
+    for neighbor in (page_num + 1, page_num - 1):
+        if 1 <= neighbor <= st.session_state.pdf_total_pages:
+            executor.submit(_rasterize, file_hash, neighbor, dpi, doc, render_lock, pages)
+
+def render_pdf_page(pdf_bytes: bytes, file_hash: str, page_num: int, zoom_level: int = 100):
     """Affiche la page PDF avec zoom via DPI dynamique"""
     try:
-        from pdf2image import convert_from_bytes
-        import io
-        
         # DPI base réduit (72) + zoom pour économiser mémoire et permettre zoom visible
         base_dpi = 72
         effective_dpi = int(base_dpi * zoom_level / 100)
+        # Rendu natif à chaque niveau (texte net aux zooms élevés); le cache
+        # de rasterisation borne le coût des niveaux déjà vus
         effective_dpi = max(18, min(effective_dpi, 200))  # Limite 18-200 DPI (permet 25%)
         
-        # Convertir la page avec le DPI calculé
-        images = convert_from_bytes(pdf_file.getbuffer(), first_page=page_num, last_page=page_num, dpi=effective_dpi)
+        # Rasteriser uniquement la page affichée (PyMuPDF, sans poppler ni PIL);
+        # les reruns sans changement de page ni de zoom relisent le cache
+        doc = _pdf_document(pdf_bytes, file_hash)
+        _, render_lock, pages = _pdf_prefetcher()
+        img_bytes = _rasterize(file_hash, page_num, effective_dpi, doc, render_lock, pages)
         
-        if images:
-            img = images[0]
-            # Afficher dans un conteneur scrollable via HTML
-            import base64
-            buffered = io.BytesIO()
-            img.save(buffered, format="PNG")
-            img_base64 = base64.b64encode(buffered.getvalue()).decode()
-            
-            # Conteneur avec scroll horizontal si image trop large
-            st.markdown(f'''
-                <div style="max-height: 500px; overflow: auto; border-radius: 0.5rem; background: #fafafa; padding: 0.5rem; border: 1px solid #ddd;">
-                    <img src="data:image/png;base64,{img_base64}" style="max-width: none; display: block; margin: auto;" />
-                </div>
-            ''', unsafe_allow_html=True)
+        # Image servie par URL (media Streamlit), pas en base64 dans le message;
+        # conteneur scrollable si l'image est plus large (style .st-key-pdf_page_view)
+        with st.container(height=500, border=True, key="pdf_page_view"):
+            st.image(img_bytes)
         
-        # Get total pages (use low DPI for speed)
-        all_images = convert_from_bytes(pdf_file.getbuffer(), dpi=30)
-        total = len(all_images)
+        # Préc./Suiv. retrouvent ensuite leur page déjà en cache
+        _prefetch_neighbors(doc, file_hash, page_num, effective_dpi)
         
-        return total
+        return st.session_state.pdf_total_pages
     except Exception as e:
         st.error(f"Erreur: {str(e)}")
         return 1
 
+# ===== PDF RAG PIPELINE =====
+# Pipelines indexés gardés en mémoire (toutes sessions confondues)
+_PDF_RAG_CACHE_SIZE = 4
+
+@st.cache_resource(show_spinner=False)
+def _pdf_rag_registry():
+    """Pipelines par (contenu du PDF, GeminiService), LRU tenu par processus"""
+    return threading.Lock(), OrderedDict()
+
+def _build_pdf_rag(file_hash: str, gemini_service, pdf_file, progress_cb=None):
+    """Pipeline indexé pour ce PDF, construit seulement au premier upload
+    
+    Le GeminiService étant propre à la session (_get_gemini_service), son id
+    distingue les sessions: un pipeline n'interroge Gemini qu'avec la clé de
+    la session qui l'a construit. Registre explicite plutôt que st.cache_resource: le
+    callback de progression met à jour des éléments créés hors de la fonction,
+    ce que le rejeu des fonctions en cache de Streamlit interdit.
+    """
+    key = (file_hash, id(gemini_service))
+    lock, pipelines = _pdf_rag_registry()
+    with lock:
+        pdf_rag = pipelines.get(key)
+        if pdf_rag is not None:
+            pipelines.move_to_end(key)
+            return pdf_rag
+    
+    from backend.rag import PDFRagPipeline
+    pdf_rag = PDFRagPipeline(gemini_service)
+    if not pdf_rag.process_pdf(pdf_file, progress_cb=progress_cb):
+        raise RuntimeError("Impossible de traiter ce PDF")
+    
+    with lock:
+        pipelines[key] = pdf_rag
+        while len(pipelines) > _PDF_RAG_CACHE_SIZE:
+            pipelines.popitem(last=False)
+    return pdf_rag
+
 # ===== MODE 1: PDF UPLOAD (CHATGPT-LIKE) =====
 if mode == "📑 Upload PDF":
     
@@ -999,17 +917,8 @@ if mode == "📑 Upload PDF":
         st.error("❌ Impossible d'accéder à ce mode. Veuillez connecter votre API Gemini d'abord.")
         st.stop()
     
-    # Handler pour navigation depuis les sources inline (DOIT être avant tout le reste)
-    if 'nav_page' in st.query_params:
-        try:
-            page_to_nav = int(st.query_params['nav_page'])
-            st.session_state.current_pdf_page = page_to_nav
-            st.session_state.pdf_viewer_visible = True
-            del st.query_params['nav_page']
-            st.toast(f"📄 Navigation vers page {page_to_nav}", icon="✅")
-            st.rerun()
-        except:
-            del st.query_params['nav_page']
+    # Styles du mode PDF (chat, viewer, upload): un seul bloc, lu une fois par processus
+    st.markdown(style_tag('pdf_mode.css'), unsafe_allow_html=True)
     
     # Layout dynamique selon visibilité du PDF viewer
     if st.session_state.pdf_rag:
@@ -1033,47 +942,11 @@ if mode == "📑 Upload PDF":
             right_col = None
         
         # ===== LEFT COLUMN: CHAT INTERFACE =====
-        with left_col:
+        @st.fragment
+        def chat_panel():
+            """Chat: une question ne relance pas le rendu du viewer"""
             # Header amélioré avec gradient et animation
             st.markdown("""
-            <style>
-            @keyframes gradientShift {
-                0% { background-position: 0% 50%; }
-                50% { background-position: 100% 50%; }
-                100% { background-position: 0% 50%; }
-            }
-            .astrali-header {
-                background: linear-gradient(-45deg, #667eea, #764ba2, #667eea, #5a67d8);
-                background-size: 400% 400%;
-                animation: gradientShift 8s ease infinite;
-                padding: 1.2rem 1.5rem;
-                border-radius: 1rem;
-                margin-bottom: 1rem;
-                box-shadow: 0 4px 20px rgba(102, 126, 234, 0.35);
-                display: flex;
-                align-items: center;
-                gap: 0.8rem;
-            }
-            .astrali-header h1 {
-                color: white;
-                font-size: 1.6rem;
-                font-weight: 800;
-                margin: 0;
-                letter-spacing: -0.5px;
-                text-shadow: 0 2px 4px rgba(0,0,0,0.1);
-            }
-            .astrali-header .subtitle {
-                color: rgba(255,255,255,0.85);
-                font-size: 0.85rem;
-                margin: 0.3rem 0 0 0;
-            }
-            .astrali-logo {
-                font-size: 2.2rem;
-                text-shadow: 0 0 0.5rem white, 0 0 1rem rgba(255,255,255,0.8);
-                color: white;
-                filter: brightness(2) saturate(0.5);
-            }
-            </style>
             <div class="astrali-header">
                 <span class="astrali-logo">🧠</span>
                 <div>
@@ -1089,102 +962,18 @@ if mode == "📑 Upload PDF":
                 st.session_state.pdf_chat_history[-1]["role"] == "user"
             )
 
-            # CSS pour le conteneur de chat scrollable
-            st.markdown("""
-            <style>
-            /* Container principal du chat */
-            div[data-testid="stVerticalBlock"] > div[data-testid="stVerticalBlockBorderWrapper"] {
-                background: linear-gradient(180deg, #fafbfc 0%, #f0f2f6 100%);
-                border: 1px solid #e0e5ec;
-                border-radius: 1rem;
-                box-shadow: inset 0 2px 8px rgba(0,0,0,0.03);
-            }
-            
-            /* Style des messages utilisateur */
-            div[data-testid="stChatMessage"][class*="user"] {
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%) !important;
-                border-radius: 1rem 1rem 0.3rem 1rem !important;
-                padding: 0.8rem 1rem !important;
-                margin: 0.5rem 0 !important;
-                box-shadow: 0 3px 12px rgba(102, 126, 234, 0.25);
-            }
-            
-            div[data-testid="stChatMessage"][class*="user"] p {
-                color: white !important;
-            }
-            
-            /* Style des messages assistant */
-            div[data-testid="stChatMessage"][class*="assistant"] {
-                background: white !important;
-                border-radius: 1rem 1rem 1rem 0.3rem !important;
-                padding: 1rem !important;
-                margin: 0.5rem 0 !important;
-                border-left: 4px solid #667eea;
-                box-shadow: 0 2px 8px rgba(0,0,0,0.06);
-            }
-            
-            /* Style des boutons sources */
-            div[data-testid="stVerticalBlockBorderWrapper"] button[kind="secondary"] {
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%) !important;
-                color: white !important;
-                border: none !important;
-                border-radius: 0.6rem !important;
-                padding: 0.4rem 0.8rem !important;
-                font-weight: 600 !important;
-                font-size: 0.8rem !important;
-                transition: all 0.2s ease !important;
-                box-shadow: 0 2px 8px rgba(102, 126, 234, 0.3) !important;
-            }
-            
-            div[data-testid="stVerticalBlockBorderWrapper"] button[kind="secondary"]:hover {
-                transform: translateY(-2px) !important;
-                box-shadow: 0 4px 12px rgba(102, 126, 234, 0.5) !important;
-            }
-            
-            /* Séparateur sources */
-            div[data-testid="stChatMessage"] hr {
-                border: none;
-                border-top: 1px solid #e8ecf4;
-                margin: 0.8rem 0;
-            }
-            
-            /* Caption sources */
-            div[data-testid="stChatMessage"] .stCaption {
-                color: #667eea !important;
-                font-weight: 600 !important;
-                font-size: 0.85rem !important;
-            }
-            
-            /* Scrollbar du chat container */
-            div[data-testid="stVerticalBlockBorderWrapper"]::-webkit-scrollbar {
-                width: 6px;
-            }
-            div[data-testid="stVerticalBlockBorderWrapper"]::-webkit-scrollbar-track {
-                background: #f1f3f5;
-                border-radius: 10px;
-            }
-            div[data-testid="stVerticalBlockBorderWrapper"]::-webkit-scrollbar-thumb {
-                background: linear-gradient(135deg, #667eea, #764ba2);
-                border-radius: 10px;
-            }
-            
-            /* Animation d'entrée des messages */
-            @keyframes messageSlideIn {
-                from { opacity: 0; transform: translateY(10px); }
-                to { opacity: 1; transform: translateY(0); }
-            }
-            
-            div[data-testid="stChatMessage"] {
-                animation: messageSlideIn 0.3s ease-out;
-            }
-            </style>
-            """, unsafe_allow_html=True)
-            
             # Conteneur de chat avec éléments natifs Streamlit
             chat_container = st.container(height=480, border=True)
             
             with chat_container:
-                for msg_idx, msg in enumerate(st.session_state.pdf_chat_history):
+                # Chat encore vide: résumé du traitement à la place des messages
+                if not st.session_state.pdf_chat_history and st.session_state.pdf_stats_html:
+                    st.markdown(st.session_state.pdf_stats_html, unsafe_allow_html=True)
+                
+                # Seuls les CHAT_WINDOW derniers messages sont rendus
+                window_start = chat_window_start('pdf_chat_history')
+                history = st.session_state.pdf_chat_history
+                for msg_idx, msg in enumerate(islice(history, window_start, None), start=window_start):
                     if msg["role"] == "user":
                         with st.chat_message("user", avatar="👤"):
                             st.markdown(msg['content'])
@@ -1198,22 +987,14 @@ if mode == "📑 Upload PDF":
                                 st.caption("📚 Sources:")
                                 
                                 # Créer une ligne de boutons pour les sources
-                                cols = st.columns(min(len(msg['sources']), 5))
-                                for idx, source in enumerate(msg.get('sources', [])):
-                                    page_num = source.get('page', 1)
-                                    score = source.get('rerank_score', 0.5)
-                                    text = source.get('text', '')[:80]
-                                    
-                                    if score > 10:
-                                        relevance_pct = max(5, min(100, int(score / 10)))
-                                    else:
-                                        relevance_pct = max(5, min(100, int(score * 100)))
-                                    
-                                    col_idx = idx % min(len(msg['sources']), 5)
-                                    with cols[col_idx]:
+                                links = msg.get('source_links') or source_links(msg['sources'])
+                                n_cols = min(len(links), 5)
+                                cols = st.columns(n_cols)
+                                for idx, (label, help_text, page_num) in enumerate(links):
+                                    with cols[idx % n_cols]:
                                         # Bouton natif Streamlit - peut modifier session_state
-                                        if st.button(f"[{idx+1}] p.{page_num}", key=f"src_{msg_idx}_{idx}", 
-                                                    help=f"{text}... ({relevance_pct}%)", 
+                                        if st.button(label, key=f"src_{msg_idx}_{idx}", 
+                                                    help=help_text, 
                                                     use_container_width=True):
                                             st.session_state.current_pdf_page = page_num
                                             st.session_state.pdf_viewer_visible = True
@@ -1235,7 +1016,7 @@ if mode == "📑 Upload PDF":
                     "role": "user",
                     "content": user_question
                 })
-                st.rerun()
+                rerun_fragment()
             
             # Process in background if needed
             if should_process:
@@ -1248,331 +1029,97 @@ if mode == "📑 Upload PDF":
                     st.session_state.pdf_chat_history.append({
                         "role": "assistant",
                         "content": response_text,
-                        "sources": sources
+                        "sources": sources,
+                        # Libellés des boutons calculés une fois, pas à chaque rerun
+                        "source_links": source_links(sources)
                     })
                     
-                    st.rerun()
+                    rerun_fragment()
                 except Exception as e:
                     st.session_state.pdf_chat_history.pop()
                     st.error(f"❌ Erreur: {str(e)}")
+
+        with left_col:
+            chat_panel()
         
         # ===== RIGHT COLUMN: PDF VIEWER (Pliable) =====
-        if st.session_state.pdf_viewer_visible and right_col is not None:
-            with right_col:
-                # CSS pour le PDF viewer amélioré
-                st.markdown("""
-                <style>
-                /* PDF Viewer Header */
-                .pdf-viewer-header {
-                    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                    color: white;
-                    padding: 0.8rem 1rem;
-                    border-radius: 0.8rem 0.8rem 0 0;
-                    margin-bottom: 0;
-                    display: flex;
-                    align-items: center;
-                    gap: 0.5rem;
-                    font-weight: 700;
-                    font-size: 1rem;
-                    box-shadow: 0 2px 8px rgba(102, 126, 234, 0.3);
-                }
-                
-                /* Zoom & Nav buttons */
-                .stButton > button {
-                    transition: all 0.2s ease !important;
-                }
-                
-                /* PDF container */
-                .pdf-page-container {
-                    background: linear-gradient(180deg, #f8f9fc 0%, #eef1f5 100%);
-                    border: 1px solid #e0e5ec;
-                    border-radius: 0.6rem;
-                    padding: 0.5rem;
-                    box-shadow: inset 0 2px 6px rgba(0,0,0,0.04);
-                }
-                
-                /* Page indicator */
-                .page-indicator {
-                    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                    color: white;
-                    padding: 0.5rem 1rem;
-                    border-radius: 2rem;
-                    font-weight: 700;
-                    font-size: 0.9rem;
-                    text-align: center;
-                    box-shadow: 0 2px 8px rgba(102, 126, 234, 0.3);
-                }
-                
-                /* Zoom display */
-                .zoom-display {
-                    background: linear-gradient(135deg, #e8ecff 0%, #f0e8ff 100%);
-                    border: 2px solid #667eea;
-                    color: #667eea;
-                    padding: 0.4rem 0.8rem;
-                    border-radius: 0.5rem;
-                    font-weight: 700;
-                    font-size: 0.85rem;
-                    text-align: center;
-                }
-                </style>
-                """, unsafe_allow_html=True)
-                
-                # Header du PDF viewer
-                st.markdown(f"""
-                <div class="pdf-viewer-header">
-                    📄 PDF Viewer - {st.session_state.pdf_file_name[:25] if st.session_state.pdf_file_name else 'Document'}...
-                </div>
-                """, unsafe_allow_html=True)
-                
-                # Zoom controls améliorés
-                zoom_col1, zoom_col2, zoom_col3, zoom_col4 = st.columns([1, 2, 1, 1], gap="small")
-                
-                with zoom_col1:
-                    if st.button("🔍➖", use_container_width=True, key="zoom_out", help="Zoom arrière"):
-                        if st.session_state.pdf_zoom_level > 25:
-                            st.session_state.pdf_zoom_level -= 25
-                            st.rerun()
-                
-                with zoom_col2:
-                    st.markdown(f"<div class='zoom-display'>🔍 {st.session_state.pdf_zoom_level}%</div>", unsafe_allow_html=True)
-                
-                with zoom_col3:
-                    if st.button("🔍➕", use_container_width=True, key="zoom_in", help="Zoom avant"):
-                        if st.session_state.pdf_zoom_level < 200:
-                            st.session_state.pdf_zoom_level += 25
-                            st.rerun()
-                
-                with zoom_col4:
-                    if st.button("↺", use_container_width=True, key="zoom_reset", help="Reset 50%"):
-                        if st.session_state.pdf_zoom_level != 50:
-                            st.session_state.pdf_zoom_level = 50
-                            st.rerun()
-                
-                # PDF viewer - rendu direct
-                total_pages = render_pdf_page(st.session_state.pdf_file, st.session_state.current_pdf_page, st.session_state.pdf_zoom_level)
-                
-                # Navigation améliorée
-                st.markdown("<div style='margin-top: 0.8rem;'></div>", unsafe_allow_html=True)
-                nav_col1, nav_col2, nav_col3 = st.columns([1, 2, 1], gap="small")
-                
-                with nav_col1:
-                    prev_disabled = st.session_state.current_pdf_page <= 1
-                    if st.button("◀ Préc.", use_container_width=True, key="prev_page", 
-                                help="Page précédente", disabled=prev_disabled):
-                        st.session_state.current_pdf_page = max(1, st.session_state.current_pdf_page - 1)
-                        st.rerun()
-                
-                with nav_col2:
-                    st.markdown(f"<div class='page-indicator'>📖 {st.session_state.current_pdf_page} / {total_pages}</div>", unsafe_allow_html=True)
-                
-                with nav_col3:
-                    next_disabled = st.session_state.current_pdf_page >= total_pages
-                    if st.button("Suiv. ▶", use_container_width=True, key="next_page", 
-                                help="Page suivante", disabled=next_disabled):
-                        st.session_state.current_pdf_page = min(total_pages, st.session_state.current_pdf_page + 1)
-                        st.rerun()
-                
-                # Page slider amélioré
-                if total_pages > 1:
-                    st.markdown("<div style='margin-top: 0.5rem;'></div>", unsafe_allow_html=True)
-                    new_page = st.slider("Navigation rapide", 1, total_pages, 
-                                        value=st.session_state.current_pdf_page, 
-                                        key="page_nav_slider", label_visibility="collapsed")
-                    if new_page != st.session_state.current_pdf_page:
-                        st.session_state.current_pdf_page = new_page
-                        st.rerun()
-    
-    else:
-        # Upload screen - Enhanced & Dynamic
-        
-        # Premium header with animation
-        st.markdown("""<style>
-            @keyframes fadeInDown {
-                from { opacity: 0; transform: translateY(-20px); }
-                to { opacity: 1; transform: translateY(0); }
-            }
-            @keyframes float {
-                0%, 100% { transform: translateY(0px); }
-                50% { transform: translateY(-10px); }
-            }
-            @keyframes pulse {
-                0%, 100% { opacity: 1; }
-                50% { opacity: 0.7; }
-            }
-            @keyframes slideInUp {
-                from { opacity: 0; transform: translateY(30px); }
-                to { opacity: 1; transform: translateY(0); }
-            }
-            
-            .premium-header {
-                animation: fadeInDown 0.6s ease-out;
-                margin-bottom: 2rem;
-            }
-            
-            .header-title {
-                font-size: 2.2rem;
-                font-weight: 800;
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                -webkit-background-clip: text;
-                -webkit-text-fill-color: transparent;
-                background-clip: text;
-                margin: 0;
-                animation: fadeInDown 0.6s ease-out;
-            }
-            
-            .header-subtitle {
-                font-size: 1rem;
-                color: #999;
-                margin: 0.5rem 0 0 0;
-                animation: fadeInDown 0.8s ease-out;
-            }
-            
-            .upload-zone {
-                border: 2px dashed #667eea;
-                border-radius: 1.2rem;
-                padding: 2.5rem 1.5rem;
-                text-align: center;
-                background: linear-gradient(135deg, rgba(102, 126, 234, 0.02) 0%, rgba(118, 75, 162, 0.02) 100%);
-                margin: 1.5rem 0;
-                transition: all 0.3s ease;
-                animation: slideInUp 0.8s ease-out;
-                cursor: pointer;
-                position: relative;
-                overflow: hidden;
-            }
-            
-            .upload-zone:hover {
-                border-color: #764ba2;
-                background: linear-gradient(135deg, rgba(102, 126, 234, 0.08) 0%, rgba(118, 75, 162, 0.08) 100%);
-                transform: translateY(-2px);
-                box-shadow: 0 8px 24px rgba(102, 126, 234, 0.15);
-            }
-            
-            .upload-icon {
-                font-size: 3.5rem;
-                margin-bottom: 1rem;
-                animation: float 3s ease-in-out infinite;
-            }
-            
-            .upload-text {
-                color: #333;
-                font-size: 1.1rem;
-                font-weight: 600;
-                margin: 0;
-            }
-            
-            .upload-subtext {
-                color: #999;
-                font-size: 0.9rem;
-                margin: 0.5rem 0 0 0;
-            }
+        @st.fragment
+        def pdf_panel():
+            """Viewer PDF: zoom et navigation ne relancent que ce fragment"""
+            # Header du PDF viewer
+            st.markdown(f"""
+            <div class="pdf-viewer-header">
+                📄 PDF Viewer - {st.session_state.pdf_file_name[:25] if st.session_state.pdf_file_name else 'Document'}...
+            </div>
+            """, unsafe_allow_html=True)
             
-            .file-info-card {
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                color: white;
-                padding: 1.2rem 1.5rem;
-                border-radius: 1rem;
-                margin: 1.2rem 0;
-                display: flex;
-                justify-content: space-between;
-                align-items: center;
-                font-size: 0.95rem;
-                animation: slideInUp 0.6s ease-out;
-                box-shadow: 0 4px 12px rgba(102, 126, 234, 0.2);
-            }
+            # Zoom controls améliorés
+            zoom_col1, zoom_col2, zoom_col3, zoom_col4 = st.columns([1, 2, 1, 1], gap="small")
             
-            .file-name {
-                font-weight: 700;
-                font-size: 1.05rem;
-            }
+            with zoom_col1:
+                if st.button("🔍➖", use_container_width=True, key="zoom_out", help="Zoom arrière"):
+                    if st.session_state.pdf_zoom_level > 25:
+                        st.session_state.pdf_zoom_level -= 25
+                        rerun_fragment()
             
-            .file-badge {
-                background: rgba(255, 255, 255, 0.2);
-                padding: 0.3rem 0.8rem;
-                border-radius: 0.5rem;
-                font-size: 0.85rem;
-                font-weight: 600;
-            }
+            with zoom_col2:
+                st.markdown(f"<div class='zoom-display'>🔍 {st.session_state.pdf_zoom_level}%</div>", unsafe_allow_html=True)
             
-            .progress-section {
-                margin-top: 1.5rem;
-            }
+            with zoom_col3:
+                if st.button("🔍➕", use_container_width=True, key="zoom_in", help="Zoom avant"):
+                    if st.session_state.pdf_zoom_level < 200:
+                        st.session_state.pdf_zoom_level += 25
+                        rerun_fragment()
             
-            .progress-label {
-                font-weight: 600;
-                color: #667eea;
-                font-size: 0.9rem;
-                margin-bottom: 0.8rem;
-                animation: fadeInDown 0.6s ease-out;
-            }
+            with zoom_col4:
+                if st.button("↺", use_container_width=True, key="zoom_reset", help="Reset 50%"):
+                    if st.session_state.pdf_zoom_level != 50:
+                        st.session_state.pdf_zoom_level = 50
+                        rerun_fragment()
             
-            .success-card {
-                background: linear-gradient(135deg, #4CAF50 0%, #45a049 100%);
-                color: white;
-                padding: 1.2rem 1.5rem;
-                border-radius: 1rem;
-                margin-top: 1.2rem;
-                display: flex;
-                justify-content: space-between;
-                align-items: center;
-                font-size: 0.95rem;
-                animation: slideInUp 0.6s ease-out;
-                box-shadow: 0 4px 12px rgba(76, 175, 80, 0.2);
-            }
+            # PDF viewer - rendu direct
+            total_pages = render_pdf_page(
+                st.session_state.pdf_bytes, st.session_state.pdf_file_hash,
+                st.session_state.current_pdf_page, st.session_state.pdf_zoom_level
+            )
             
-            .stats-grid {
-                display: grid;
-                grid-template-columns: 1fr 1fr;
-                gap: 1rem;
-                margin-top: 1rem;
-            }
+            # Navigation améliorée
+            st.markdown("<div style='margin-top: 0.8rem;'></div>", unsafe_allow_html=True)
+            nav_col1, nav_col2, nav_col3 = st.columns([1, 2, 1], gap="small")
             
-            .stat-box {
-                background: #f5f5f5;
-                padding: 1rem;
-                border-radius: 0.8rem;
-                text-align: center;
-                border-left: 3px solid #667eea;
-                animation: slideInUp 0.7s ease-out;
-            }
+            with nav_col1:
+                prev_disabled = st.session_state.current_pdf_page <= 1
+                if st.button("◀ Préc.", use_container_width=True, key="prev_page", 
+                            help="Page précédente", disabled=prev_disabled):
+                    st.session_state.current_pdf_page = max(1, st.session_state.current_pdf_page - 1)
+                    rerun_fragment()
             
-            .stat-value {
-                font-size: 1.8rem;
-                font-weight: 800;
-                color: #667eea;
-                margin: 0;
-            }
+            with nav_col2:
+                st.markdown(f"<div class='page-indicator'>📖 {st.session_state.current_pdf_page} / {total_pages}</div>", unsafe_allow_html=True)
             
-            .stat-label {
-                font-size: 0.85rem;
-                color: #999;
-                margin-top: 0.5rem;
-            }
+            with nav_col3:
+                next_disabled = st.session_state.current_pdf_page >= total_pages
+                if st.button("Suiv. ▶", use_container_width=True, key="next_page", 
+                            help="Page suivante", disabled=next_disabled):
+                    st.session_state.current_pdf_page = min(total_pages, st.session_state.current_pdf_page + 1)
+                    rerun_fragment()
             
-            @media (max-width: 768px) {
-                .header-title {
-                    font-size: 1.8rem;
-                }
-                
-                .upload-zone {
-                    padding: 2rem 1rem;
-                }
-                
-                .upload-icon {
-                    font-size: 2.5rem;
-                }
-                
-                .file-info-card {
-                    flex-direction: column;
-                    text-align: center;
-                    gap: 0.5rem;
-                }
-                
-                .stats-grid {
-                    grid-template-columns: 1fr;
-                }
-            }
-        </style>""", unsafe_allow_html=True)
+            # Page slider amélioré
+            if total_pages > 1:
+                st.markdown("<div style='margin-top: 0.5rem;'></div>", unsafe_allow_html=True)
+                new_page = st.slider("Navigation rapide", 1, total_pages, 
+                                    value=st.session_state.current_pdf_page, 
+                                    key="page_nav_slider", label_visibility="collapsed")
+                if new_page != st.session_state.current_pdf_page:
+                    st.session_state.current_pdf_page = new_page
+                    rerun_fragment()
+
+        if st.session_state.pdf_viewer_visible and right_col is not None:
+            with right_col:
+                pdf_panel()
+    
+    else:
+        # Upload screen - Enhanced & Dynamic
         
         st.markdown("""<div>
             <h1 class="header-title">🧠 Astrali</h1>
@@ -1609,7 +1156,17 @@ if mode == "📑 Upload PDF":
                 """, unsafe_allow_html=True)
         
         if uploaded_file:
-            file_size_mb = len(uploaded_file.getvalue()) / (1024 * 1024)
+            # Octets, taille et empreinte lus une seule fois par upload (getvalue copie tout)
+            new_file = False
+            if uploaded_file.file_id != st.session_state.pdf_upload_id:
+                st.session_state.pdf_upload_id = uploaded_file.file_id
+                st.session_state.pdf_bytes = uploaded_file.getvalue()
+                st.session_state.pdf_size_mb = len(st.session_state.pdf_bytes) / (1024 * 1024)
+                # Identité = contenu, pas le nom
+                file_hash = hashlib.blake2b(st.session_state.pdf_bytes, digest_size=16).hexdigest()
+                # Un échec précédent laisse pdf_rag à None: le même PDF peut être retenté
+                new_file = file_hash != st.session_state.pdf_file_hash or st.session_state.pdf_rag is None
+            file_size_mb = st.session_state.pdf_size_mb
             
             # File info - enhanced
             file_name_display = uploaded_file.name[:40]
@@ -1622,11 +1179,13 @@ if mode == "📑 Upload PDF":
             """, unsafe_allow_html=True)
             
             # Check if new file
-            if uploaded_file.name != st.session_state.pdf_file_name:
+            if new_file:
                 st.session_state.pdf_file_name = uploaded_file.name
                 st.session_state.pdf_file = uploaded_file
-                st.session_state.pdf_chat_history = []
+                st.session_state.pdf_chat_history = deque(maxlen=PDF_CHAT_HISTORY_MAX)
+                st.session_state.pdf_chat_history_window_extra = 0
                 st.session_state.pdf_rag = None
+                st.session_state.pdf_stats_html = None
                 st.session_state.current_pdf_page = 1
                 
                 # Processing with enhanced progress
@@ -1639,74 +1198,43 @@ if mode == "📑 Upload PDF":
                     if not st.session_state.gemini_service:
                         st.error("⚠️ Configurez votre clé API d'abord")
                     else:
-                        # Step 1: Initialize
-                        status_text.markdown("**Étape 1/3:** Initialisation du pipeline...")
-                        progress_bar.progress(20)
-                        import time
-                        time.sleep(0.3)
-                        pdf_rag = PDFRagPipeline(st.session_state.gemini_service)
+                        # Progression réelle, rapportée par le pipeline à chaque étape
+                        def report_progress(fraction: float, message: str):
+                            progress_bar.progress(fraction)
+                            status_text.markdown(f"**{message}**")
                         
-                        # Step 2: Extract & Process
-                        status_text.markdown("**Étape 2/3:** Extraction et traitement du texte...")
-                        progress_bar.progress(50)
-                        time.sleep(0.3)
-                        pdf_rag.process_pdf(uploaded_file)
-                        
-                        # Step 3: Indexing
-                        status_text.markdown("**Étape 3/3:** Indexation et création des embeddings...")
-                        progress_bar.progress(85)
-                        time.sleep(0.3)
+                        status_text.markdown("**Initialisation du pipeline...**")
+                        pdf_rag = _build_pdf_rag(
+                            file_hash, st.session_state.gemini_service,
+                            uploaded_file, report_progress
+                        )
                         
                         st.session_state.pdf_rag = pdf_rag
+                        # Empreinte retenue seulement après un traitement réussi
+                        st.session_state.pdf_file_hash = file_hash
                         progress_bar.progress(100)
                         status_text.empty()
                         
                         # Success - enhanced
-                        pages = len(set(c.page_num for c in pdf_rag.chunks))
-                        chunks = len(pdf_rag.chunks)
+                        pages = pdf_rag.num_pages
+                        chunks = pdf_rag.num_chunks
                         
-                        st.markdown("""
+                        # Carte de succès et statistiques: construites une fois, affichées
+                        # par le panneau de chat après le rerun (ce run est aussitôt remplacé)
+                        mb_display = f"{file_size_mb:.1f}"
+                        stat_boxes = "".join(
+                            f'<div class="stat-box"><p class="stat-value">{value}</p>'
+                            f'<p class="stat-label">{label}</p></div>'
+                            for value, label in ((pages, "Pages"), (chunks, "Chunks"), (mb_display, "MB"))
+                        )
+                        st.session_state.pdf_stats_html = f"""
                         <div class="success-card">
                             <span>✅ Traitement réussi!</span>
                         </div>
-                        """, unsafe_allow_html=True)
-                        
-                        st.markdown("""
-                        <div class="stats-grid">
-                        """, unsafe_allow_html=True)
-                        
-                        col1, col2, col3 = st.columns(3, gap="medium")
-                        
-                        mb_display = f"{file_size_mb:.1f}"
-                        
-                        with col1:
-                            st.markdown(f"""
-                            <div class="stat-box">
-                                <p class="stat-value">{pages}</p>
-                                <p class="stat-label">Pages</p>
-                            </div>
-                            """, unsafe_allow_html=True)
-                        
-                        with col2:
-                            st.markdown(f"""
-                            <div class="stat-box">
-                                <p class="stat-value">{chunks}</p>
-                                <p class="stat-label">Chunks</p>
-                            </div>
-                            """, unsafe_allow_html=True)
-                        
-                        with col3:
-                            st.markdown(f"""
-                            <div class="stat-box">
-                                <p class="stat-value">{mb_display}</p>
-                                <p class="stat-label">MB</p>
-                            </div>
-                            """, unsafe_allow_html=True)
-                        
-                        st.markdown("</div>", unsafe_allow_html=True)
-                        st.markdown("</div>", unsafe_allow_html=True)
+                        <div class="stats-grid">{stat_boxes}</div>
+                        """
                         
-                        time.sleep(0.5)
+                        # Rerun immédiat vers la mise en page chat + viewer
                         st.rerun()
                         
                 except Exception as e:
@@ -1731,12 +1259,12 @@ elif mode == "📊 YFinance":
         all_tickers = st.checkbox("Tous les tickers", value=False, key="all_tickers")
         
         if all_tickers:
-            selected_tickers = ['AAPL', 'MSFT', 'GOOGL', 'AMZN', 'TSLA']
+            selected_tickers = list(_TICKERS)
         else:
             selected_tickers = st.multiselect(
                 "Sélectionner tickers:",
-                ['AAPL', 'MSFT', 'GOOGL', 'AMZN', 'TSLA'],
-                default=['AAPL'],
+                _TICKERS,
+                default=('AAPL',),
                 key="ticker_select"
             )
         
@@ -1750,6 +1278,7 @@ elif mode == "📊 YFinance":
             else:
                 with st.spinner("Chargement données Yahoo Finance..."):
                     try:
+                        from backend.rag.yfinance_rag import YFinanceRagAssistant
                         yfinance_rag = YFinanceRagAssistant(
                             st.session_state.gemini_service,
                             tickers=selected_tickers
@@ -1786,8 +1315,13 @@ elif mode == "📊 YFinance":
         # Chat section
         st.subheader("💬 Questions sur les données")
         
-        # Display chat history
-        for msg in st.session_state.chat_history:
+        # Dernière question sans réponse: soumise au run précédent ou run interrompu
+        history = st.session_state.chat_history
+        pending = bool(history) and history[-1]["role"] == "user"
+        
+        # Display chat history (fenêtre des derniers messages)
+        window_start = chat_window_start('chat_history')
+        for msg in history[window_start:]:
             with st.chat_message(msg["role"]):
                 st.write(msg["content"])
         
@@ -1795,28 +1329,31 @@ elif mode == "📊 YFinance":
         user_question = st.chat_input("Votre question...")
         
         if user_question:
-            st.session_state.chat_history.append({
+            # La question s'affiche d'abord; la réponse est générée au run suivant
+            history.append({
                 "role": "user",
                 "content": user_question
             })
-            
-            with st.chat_message("user"):
-                st.write(user_question)
-            
+            st.rerun()
+        
+        if pending:
             with st.chat_message("assistant"):
-                with st.spinner("IA réfléchit..."):
-                    try:
-                        result = st.session_state.yfinance_rag.query(user_question)
-                    except Exception as e:
-                        st.error(f"Erreur: {str(e)}")
-                        st.session_state.chat_history.pop()
-                        result = None
+                # Réponse affichée au fil de la génération
+                try:
+                    response = st.write_stream(
+                        st.session_state.yfinance_rag.query_stream(history[-1]["content"])
+                    )
+                except Exception as e:
+                    st.error(f"Erreur: {str(e)}")
+                    response = None
                 
-                if result:
-                    st.write(result.get('response', ''))
-                    st.session_state.chat_history.append({
+                if response:
+                    history.append({
                         "role": "assistant",
-                        "content": result.get('response', '')
+                        "content": response
                     })
+                else:
+                    # Pas de nouvel essai implicite au prochain rerun
+                    history.pop()
     else:
         st.info("Configurez les tickers dans la sidebar et cliquez sur 'Charger les données'")
@@ -0,0 +1,29 @@
+import numpy as np
+
+from backend.utils import SemanticCache
+
+
+def _unit(vec):
+    vec = np.asarray(vec, dtype=np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+def test_questions_differing_by_number_do_not_collide():
+    cache = SemanticCache()
+    embedding = _unit([1.0, 0.2, 0.1, 0.0])
+    # Embedding quasi identique : seuls les nombres distinguent les questions
+    near = _unit([1.0, 0.2, 0.1, 0.001])
+    cache.put(embedding, "réponse T2", question="Chiffre d'affaires au T2 2023 ?")
+
+    assert cache.get(near, question="Chiffre d'affaires au T3 2023 ?") is None
+    assert cache.get(near, question="Que dit la page 14 ?") is None
+    assert cache.get(near, question="Quel est le chiffre d'affaires du T2 2023 ?") == "réponse T2"
+
+
+def test_scope_is_respected():
+    cache = SemanticCache()
+    embedding = _unit([0.0, 1.0, 0.0, 0.0])
+    cache.put(embedding, "AAPL", scope=("AAPL",), question="Prix de clôture en 2024 ?")
+
+    assert cache.get(embedding, scope=("MSFT",), question="Prix de clôture en 2024 ?") is None
+    assert cache.get(embedding, scope=("AAPL",), question="Prix de clôture en 2024 ?") == "AAPL"